@@ -24,3 +24,76 @@
 # ap.active(True)
 # ap.config(essid='ESP-AP', password='00000000', authmode=3)
 # print("网络配置:", ap.ifconfig())
+
+# -----------
+# OTA更新回滚
+# -----------
+# main.py通过/upload更新文件后会写入ota_pending.json，新版本启动成功后删除该记录。
+# 若记录仍在且重启次数超过OTA_MAX_BOOTS，或新main.py无法导入，则从.bak恢复原文件。
+import gc
+import sys
+import uos
+import ujson
+import machine
+
+OTA_PENDING = 'ota_pending.json'
+OTA_MAX_BOOTS = 2
+
+
+def _exists(path):
+    try:
+        uos.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def ota_rollback(files):
+    for name in files:
+        try:
+            uos.remove(name + '.new')
+        except OSError:
+            pass
+        if _exists(name + '.bak'):
+            if _exists(name):
+                uos.remove(name)
+            uos.rename(name + '.bak', name)
+        elif _exists(name):
+            uos.remove(name)  # 更新前不存在的文件
+    uos.remove(OTA_PENDING)
+    print("OTA回滚:", files)
+
+
+def ota_check():
+    try:
+        with open(OTA_PENDING) as f:
+            pending = ujson.load(f)
+    except OSError:
+        return
+    except ValueError:
+        uos.remove(OTA_PENDING)  # 记录损坏，无法判断需要回滚的文件
+        return
+
+    pending["boots"] = pending.get("boots", 0) + 1
+    failed = pending["boots"] > OTA_MAX_BOOTS
+    # 替换中途断电：目标文件缺失
+    failed = failed or any(not _exists(name) for name in pending["files"])
+    if not failed and ('main.py' in pending["files"] or 'config.json' in pending["files"]):
+        # 试导入新代码，提前发现语法错误或配置错误（导入时不会启动服务）
+        try:
+            __import__('main')
+        except Exception as e:
+            print("OTA新版本导入失败:", e)
+            failed = True
+        sys.modules.pop('main', None)
+        gc.collect()
+
+    if failed:
+        ota_rollback(pending["files"])
+        machine.reset()
+    else:
+        with open(OTA_PENDING, 'w') as f:
+            ujson.dump(pending, f)
+
+
+ota_check()
@@ -1,4 +1,5 @@
 import _thread
+import gc
 import time
 
 import ujson
@@ -7,6 +8,21 @@ import usocket
 import utime
 import random
 import machine
+import uarray
+import ubinascii
+import uhashlib
+import uio
+import uos
+import ustruct
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    import ntptime
+except ImportError:
+    ntptime = None
 
 # -----------
 # 定义常量
@@ -20,7 +36,9 @@ sta_data = {
 scan_data = {
     "status": "idle",  # idle/scanning/ready/error
     "result": "",
-    "last_update": 0
+    "last_update": 0,
+    "aps": [],  # 最近一次扫描到的(信道, RSSI)，供AP信道选择使用
+    "aps_ticks": 0
 }
 AUTH_MODES = {
     "OPEN": 0,
@@ -36,6 +54,185 @@ with open('config.json') as f:
     config = ujson.load(f)
     fun_config = config['functions']
     wifi_config = config['WIFI']
+config_version = 0  # 每次保存配置后递增，用于页面缓存失效
+page_cache = {}  # 缓存键 -> (配置版本, 压缩后的body, 压缩方式)，只缓存压缩结果以节省内存
+config_batch = {"active": False, "ap_changed": False}  # 批量事务状态，进行中时推迟持久化与AP重启
+
+# -----------
+# 日志环形缓冲区
+# -----------
+LOG_DEBUG = 0
+LOG_INFO = 1
+LOG_WARN = 2
+LOG_ERROR = 3
+LOG_LEVELS = ("DEBUG", "INFO", "WARN", "ERROR")
+_log_config = config.get('LOG', {})
+log_data = {
+    "size": _log_config.get('size', 64),
+    "level": LOG_LEVELS.index(_log_config.get('level', "INFO")),  # 低于该级别的日志直接丢弃
+    "echo": _log_config.get('echo', False),  # 同时输出到串口（需即时格式化）
+    "seq": 0  # 下一条日志的序号
+}
+# 预分配的存储：消息只保存格式串和参数，读取时才格式化
+log_ticks = uarray.array('L', [0] * log_data["size"])
+log_levels = bytearray(log_data["size"])
+log_fmts = [None] * log_data["size"]
+log_args = [None] * log_data["size"]
+log_lock = _thread.allocate_lock()
+
+
+def log(level: int, fmt: str, *args):
+    """
+    记录日志
+    :param level: LOG_DEBUG/LOG_INFO/LOG_WARN/LOG_ERROR
+    :param fmt: %格式串
+    :param args: 格式化参数（延迟到读取时格式化）
+    """
+    if level < log_data["level"]:
+        return
+    with log_lock:
+        seq = log_data["seq"]
+        i = seq % log_data["size"]
+        log_ticks[i] = utime.ticks_ms()
+        log_levels[i] = level
+        log_fmts[i] = fmt
+        log_args[i] = args
+        log_data["seq"] = seq + 1
+    if log_data["echo"]:
+        print(LOG_LEVELS[level], _log_format(fmt, args))
+
+
+def _log_format(fmt, args):
+    if not args:
+        return fmt
+    try:
+        return fmt % args
+    except (TypeError, ValueError):
+        return f"{fmt} {args}"
+
+
+def log_read(since: int = 0, level: int = 0) -> dict:
+    """
+    读取日志（增量）
+    :param since: 上次返回的next序号，只返回之后的日志
+    :param level: 最低级别
+    :return: {"next": 下次请求的since, "dropped": 已被覆盖的条数, "entries": [[序号, ticks_ms, 级别, 消息], ...]}
+    """
+    with log_lock:
+        end = log_data["seq"]
+        first = max(since, end - log_data["size"], 0)
+        raw = []
+        for seq in range(first, end):
+            i = seq % log_data["size"]
+            if log_levels[i] >= level:
+                raw.append((seq, log_ticks[i], log_levels[i], log_fmts[i], log_args[i]))
+    entries = [[seq, ticks, LOG_LEVELS[lv], _log_format(fmt, args)] for seq, ticks, lv, fmt, args in raw]
+    return {"next": end, "dropped": max(first - since, 0), "entries": entries}
+
+
+# -----------
+# 请求追踪
+# -----------
+_trace_config = config.get('TRACE', {})
+trace_data = {
+    "enabled": _trace_config.get('enabled', False),
+    "sample": _trace_config.get('sample', 1),  # 每N个请求记录1个
+    "size": _trace_config.get('size', 256),
+    "requests": 0,  # 请求计数
+    "count": 0,  # 已记录的span总数
+    "active": False  # 当前请求是否被采样
+}
+# 预分配的span存储
+trace_starts = uarray.array('L', [0] * trace_data["size"])
+trace_durs = uarray.array('L', [0] * trace_data["size"])
+trace_ids = uarray.array('H', [0] * trace_data["size"])  # span名称在trace_names中的序号
+trace_reqs = uarray.array('H', [0] * trace_data["size"])
+trace_names = []
+
+
+def trace_request():
+    """
+    请求开始时调用，按采样率决定本请求是否记录
+    """
+    if not trace_data["enabled"]:
+        trace_data["active"] = False
+        return
+    trace_data["requests"] += 1
+    trace_data["active"] = trace_data["requests"] % trace_data["sample"] == 0
+
+
+def trace_begin() -> int:
+    """
+    :return: span开始时间（ticks_us），当前请求未采样时为0
+    """
+    return utime.ticks_us() if trace_data["active"] else 0
+
+
+def trace_end(name: str, start: int):
+    """
+    结束span并记录
+    :param name: span名称
+    :param start: trace_begin的返回值
+    """
+    if not start:
+        return
+    dur = utime.ticks_diff(utime.ticks_us(), start)
+    if name in trace_names:
+        name_id = trace_names.index(name)
+    else:
+        name_id = len(trace_names)
+        trace_names.append(name)
+    i = trace_data["count"] % trace_data["size"]
+    trace_starts[i] = start
+    trace_durs[i] = dur
+    trace_ids[i] = name_id
+    trace_reqs[i] = trace_data["requests"] & 0xffff
+    trace_data["count"] += 1
+
+
+def trace_control(enabled: str, sample: str, clear: str = "") -> str:
+    """
+    开关请求追踪
+    :param enabled: 1/0
+    :param sample: 采样率，每N个请求记录1个，留空不变
+    :param clear: 1时清空已记录的span
+    :return: 当前状态
+    """
+    if enabled.strip() not in ("0", "1"):
+        return "错误：enabled需为1或0"
+    if clear.strip() not in ("", "0", "1"):
+        return "错误：clear需为1或0"
+    if sample.strip():
+        try:
+            sample = int(sample)
+        except ValueError:
+            return "错误：采样率需为正整数"
+        if sample < 1:
+            return "错误：采样率需为正整数"
+        trace_data["sample"] = sample
+    if clear.strip() == "1":
+        trace_data["count"] = 0
+    trace_data["enabled"] = enabled.strip() == "1"
+    if not trace_data["enabled"]:
+        trace_data["active"] = False
+    return f"追踪：{'开启' if trace_data['enabled'] else '关闭'}，采样1/{trace_data['sample']}，已记录{trace_data['count']}个span"
+
+
+def trace_export(conn):
+    """
+    以Chrome trace-event JSON格式流式输出已记录的span（可导入chrome://tracing或Perfetto）
+    """
+    conn.send('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n{"traceEvents":[')
+    count = min(trace_data["count"], trace_data["size"])
+    first = trace_data["count"] - count
+    base = trace_starts[first % trace_data["size"]]
+    for n in range(count):
+        i = (first + n) % trace_data["size"]
+        ts = utime.ticks_diff(trace_starts[i], base)
+        conn.send(('' if n == 0 else ',') +
+                  f'{{"name":"{trace_names[trace_ids[i]]}","ph":"X","ts":{ts},"dur":{trace_durs[i]},'
+                  f'"pid":1,"tid":1,"args":{{"req":{trace_reqs[i]}}}}}')
+    conn.send('],"displayTimeUnit":"ms"}')
 
 
 # -----------
@@ -74,26 +271,84 @@ def safe_ssid_decode(b):
     return "Hex:" + ''.join('%02x' % x for x in b)
 
 
+def save_config():
+    """
+    持久化配置到config.json（批量事务进行中时推迟到提交）
+    """
+    global config_version
+    if config_batch["active"] or ota_data["config_replaced"]:
+        return  # OTA替换config.json后，内存中的旧配置不能覆盖新文件
+    with open('config.json', 'w') as f:
+        ujson.dump(config, f)
+    config_version += 1
+    page_cache.clear()  # 旧版本页面立即释放
+
+
+def get_header(request: str, name: str) -> str:
+    """
+    获取请求头的值（不区分大小写）
+    :param request: 原始请求字符串
+    :param name: 请求头名称
+    :return: 头的值，不存在时返回空字符串
+    """
+    name = name.lower() + ':'
+    head = request.split('\r\n\r\n', 1)[0]
+    for line in head.split('\r\n')[1:]:
+        if line[:len(name)].lower() == name:
+            return line[len(name):].strip()
+    return ""
+
+
+def request_line(request: str):
+    """
+    解析请求行
+    :param request: 原始请求字符串
+    :return: (方法, 路径含查询串)，请求行无效时为("", "")
+    """
+    parts = request.split('\r\n', 1)[0].split()
+    if len(parts) < 2 or not parts[1].startswith('/'):
+        return "", ""
+    return parts[0], parts[1]
+
+
+def parse_params(s):
+    """
+    解析URL编码的键值对（查询字符串或表单body）
+    :param s: 如"a=1&b=%E4%BD%A0"
+    :return: 参数字典
+    """
+    params = {}
+    for pair in s.split('&'):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            params[key] = unquote(value.replace('+', ' '))  # 同时处理空格编码
+    return params
+
+
 # -----------
 # 预定义函数示例（需与config.json中的name对应）
 # -----------
-def ap_start(ssid: str, encryption: str = "OPEN", password: str = "00000000"):
+def ap_start(ssid: str, encryption: str = "OPEN", password: str = "00000000", channel="auto"):
     """
     启动热点
     :param ssid: 热点名称
     :param password: 密码
     :param encryption: 加密方式，如"WPA/WPA2"、"WEP"、"OPEN"、"WPA2"、"WPA"
+    :param channel: 信道号，"auto"为扫描后选择最空闲的信道
     :return: 热点IP地址
     """
+    if channel == "auto":
+        channel = channel_pick()
+    channel = int(channel)
     if not AP.active():
         AP.active(True)
     authmode = AUTH_MODES[encryption]
+    log(LOG_INFO, "ap_start: %s %s 信道%d", ssid, encryption, channel)
     if authmode == 0:
-        print(f"ap_start: {ssid, encryption}")
-        AP.config(essid=ssid, authmode=authmode)
+        AP.config(essid=ssid, authmode=authmode, channel=channel)
     elif authmode in [1, 2, 3, 4]:
-        print(f"ap_start: {ssid, encryption, password}")
-        AP.config(essid=ssid, authmode=authmode, password=password)
+        AP.config(essid=ssid, authmode=authmode, password=password, channel=channel)
+    channel_data.update(channel=channel, since=utime.ticks_ms())
 
 
 def sta_start(ssid: str, password: str) -> str:
@@ -177,6 +432,8 @@ def sta_start(ssid: str, password: str) -> str:
                 ip=STA.ifconfig()[0],
                 rssi=STA.status("rssi")
             )
+            # 联网后校时，at定时任务依赖正确的时间
+            time_sync()
 
         # 更新连接中状态（不存储明文密码）
         sta_data.update(
@@ -209,16 +466,61 @@ def sta_start(ssid: str, password: str) -> str:
 
 def led_control(state, brightness):
     """
-    控制LED
-    :param state: 开关状态
-    :param brightness: 亮度百分比
+    控制LED（只设置目标亮度，渐变由后台线程完成，请求立即返回）
+    连续多次调用会合并，只执行最后一次的目标
+    :param state: 开关状态，on/off（或1/0）
+    :param brightness: 亮度百分比 0-100，留空保持当前亮度
+    :return: 结果信息
     """
-    print(f"Setting LED: {state} at {brightness}%")
-    # 实际硬件控制代码
+    state = str(state).strip().lower()
+    if state in ("on", "1", "true"):
+        on = True
+    elif state in ("off", "0", "false"):
+        on = False
+    else:
+        return "错误：状态需为on/off"
+
+    brightness = str(brightness).strip().rstrip('%')
+    if brightness:
+        try:
+            brightness = int(float(brightness))
+        except (ValueError, OverflowError):  # 非数字、nan、inf
+            return "错误：亮度需为0-100的数字"
+        if not 0 <= brightness <= 100:
+            return "错误：亮度需为0-100"
+    else:
+        brightness = led_data["brightness"]
+
+    if led_data["pwm"] is None:
+        led_init()
+
+    with led_lock:
+        led_data.update(
+            state="on" if on else "off",
+            brightness=brightness,
+            target=brightness * 65535 // 100 if on else 0
+        )
+        start = not led_data["fading"]
+        led_data["fading"] = True
+    log(LOG_DEBUG, "LED目标: %s %d%%", led_data["state"], brightness)
+    if start:
+        _thread.start_new_thread(_led_fade_task, ())
+    return f"LED: {led_data['state']} {brightness}%"
+
+
+def read_temperature() -> float:
+    """
+    读取温度传感器（由后台采样器按固定间隔调用）
+    :return: 摄氏度
+    """
+    return random.uniform(20, 30)  # 示例温度值
 
 
 def get_temperature():
-    return f"{random.uniform(20, 30):.1f}°C"  # 示例温度值
+    value = sensor_latest("temperature")
+    if value is None:
+        return "采样中..."
+    return f"{value:.1f}°C"
 
 
 def restart():
@@ -260,8 +562,7 @@ def reorder_functions(new_order):
 
         # 更新配置
         config['function_list'] = new_list
-        with open('config.json', 'w') as f:
-            ujson.dump(config, f)
+        save_config()
         return "已完成"
 
     except Exception as e:
@@ -297,8 +598,7 @@ def remove_config_function(target_id: str) -> str:
         config['function_list'].remove(target_id)
 
         # 持久化保存
-        with open('config.json', 'w') as f:
-            ujson.dump(config, f)
+        save_config()
 
         return f"成功移除 '{target_id}'，剩余功能数：{len(config['function_list'])}"
 
@@ -359,9 +659,11 @@ def update_ap_config(ssid: str, encryption: str, password: str) -> str:
 
     # 更新配置
     config['WIFI']['ap'].update(ssid=ssid, encryption=encryption, password=password)
-    with open('config.json', 'w') as f:
-        ujson.dump(config, f)
-    ap_start(**config['WIFI']['ap'])  # 立即生效
+    save_config()
+    if config_batch["active"]:
+        config_batch["ap_changed"] = True  # 批量提交后再生效
+    else:
+        ap_start(**config['WIFI']['ap'])  # 立即生效
     return "AP配置更新成功"
 
 
@@ -388,6 +690,7 @@ def async_scan_wifi():
             start_time = utime.ticks_ms()
             aps = STA.scan()
             scan_time = utime.ticks_diff(utime.ticks_ms(), start_time)
+            scan_data.update(aps=[(ap[2], ap[3]) for ap in aps], aps_ticks=utime.ticks_ms())
 
             if not aps:
                 scan_data.update(
@@ -553,8 +856,7 @@ def update_sta_config(ssid: str, password: str) -> str:
     # ---------------------
     # 持久化与连接
     # ---------------------
-    with open('config.json', 'w') as f:
-        ujson.dump(config, f)
+    save_config()
 
     valid_configs = [c for c in config['WIFI']['sta']
                      if c['ssid'] and c['password']]
@@ -584,15 +886,14 @@ def delete_sta_config(target_ssid: str) -> str:
     deleted_count = original_count - len(sta_list)
 
     if deleted_count == 0:
-        return "未找到指定SSID"
+        return "错误：未找到指定SSID"
 
     # 清理现有空项后添加一个占位符
     sta_list[:] = [e for e in sta_list if not (e['ssid'] == "" and e['password'] == "")]
     sta_list.append({"ssid": "", "password": ""})
 
     # 持久化
-    with open('config.json', 'w') as f:
-        ujson.dump(config, f)
+    save_config()
 
     # 重新连接
     valid_configs = [c for c in sta_list if c['ssid']]
@@ -635,8 +936,7 @@ def add_sta_config(new_ssid: str, new_password: str) -> str:
     sta_list.append({"ssid": new_ssid, "password": new_password})
 
     # 持久化
-    with open('config.json', 'w') as f:
-        ujson.dump(config, f)
+    save_config()
 
     return f"已成功添加 {new_ssid}，当前配置数量：{len(sta_list)}"
 
@@ -694,8 +994,7 @@ def sort_sta_config(mode: str = "connection") -> str:
     # 配置更新与持久化
     # ---------------------
     config['WIFI']['sta'] = valid_items
-    with open('config.json', 'w') as f:
-        ujson.dump(config, f)
+    save_config()
 
     # ---------------------
     # 生成状态报告
@@ -710,6 +1009,1005 @@ def sort_sta_config(mode: str = "connection") -> str:
     return f"排序完成（模式：{mode}）| 首项：{valid_items[0]['ssid']} " + " ".join(status)
 
 
+# -----------
+# 批量配置
+# -----------
+# 操作名 -> (处理函数, 参数名)
+BATCH_OPS = {
+    "add_sta": (add_sta_config, ("ssid", "password")),
+    "update_sta": (update_sta_config, ("ssid", "password")),
+    "delete_sta": (delete_sta_config, ("ssid",)),
+    "update_ap": (update_ap_config, ("ssid", "encryption", "password")),
+    "reorder": (reorder_functions, ("order",)),
+    "remove_function": (remove_config_function, ("id",))
+}
+
+
+def _batch_restore(original):
+    global config, fun_config, wifi_config
+    config = original
+    fun_config = config['functions']
+    wifi_config = config['WIFI']
+
+
+def batch_config(ops) -> str:
+    """
+    事务性批量修改配置：所有操作在内存副本上依次校验执行，全部成功后只持久化一次
+    任一操作失败则全部回滚
+    :param ops: 操作列表（或其JSON字符串），如
+                [{"op": "add_sta", "ssid": "a", "password": "12345678"},
+                 {"op": "reorder", "order": ["test", "led_control", ...]},
+                 {"op": "remove_function", "id": "test"}]
+    :return: 成功信息或错误提示
+    """
+    if isinstance(ops, str):
+        try:
+            ops = ujson.loads(ops)
+        except ValueError:
+            return "错误：操作列表不是有效JSON"
+    if not isinstance(ops, list) or not ops:
+        return "错误：操作列表为空"
+
+    original = config
+    _batch_restore(ujson.loads(ujson.dumps(config)))  # 切换到内存副本
+    config_batch.update(active=True, ap_changed=False)
+    error = None
+    try:
+        for i, op in enumerate(ops, 1):
+            entry = BATCH_OPS.get(op.get("op")) if isinstance(op, dict) else None
+            if entry is None:
+                error = f"错误：第{i}项操作无效，可选：{', '.join(BATCH_OPS)}"
+                break
+            func, names = entry
+            args = [op.get(name, "") for name in names]
+            args = [",".join(a) if isinstance(a, list) else str(a) for a in args]
+            try:
+                result = func(*args)
+            except Exception as e:
+                result = f"错误：{str(e)}"
+            if result.startswith("错误"):
+                error = f"错误：第{i}项({op['op']})失败：{result.split('：', 1)[-1]}"
+                break
+    finally:
+        config_batch["active"] = False
+
+    if error:
+        _batch_restore(original)
+        return error + "，已全部回滚"
+    try:
+        save_config()
+    except Exception as e:
+        _batch_restore(original)
+        return f"错误：保存失败：{str(e)}，已全部回滚"
+    if config_batch["ap_changed"]:
+        ap_start(**config['WIFI']['ap'])
+    log(LOG_INFO, "批量配置提交：%d项", len(ops))
+    return f"批量提交成功：{len(ops)}项操作"
+
+
+# -----------
+# LED控制
+# -----------
+class SimPWM:
+    """
+    模拟PWM后端（无硬件PWM时使用，如在Linux上调试）
+    与machine.PWM接口一致，并记录占空比时间线
+    """
+
+    def __init__(self, pin=None, freq=1000, duty_u16=0, size=256):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+        self.size = size
+        self.timeline = []  # [(ticks_ms, duty_u16), ...]
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+        self.timeline.append((utime.ticks_ms(), value))
+        if len(self.timeline) > self.size:
+            self.timeline.pop(0)
+
+    def deinit(self):
+        pass
+
+
+led_data = {
+    "state": "off",
+    "brightness": 100,  # 百分比
+    "target": 0,  # 目标占空比（duty_u16）
+    "duty": 0,  # 当前占空比
+    "fading": False,
+    "pwm": None
+}
+led_lock = _thread.allocate_lock()
+
+
+def led_init():
+    """
+    按config.json中的LED配置初始化PWM输出
+    硬件不支持PWM或backend为"sim"时使用模拟后端
+    """
+    led_config = config.get('LED', {})
+    pin = led_config.get('pin', 2)
+    freq = led_config.get('freq', 1000)
+    pwm = None
+    if led_config.get('backend', 'pwm') == 'pwm' and hasattr(machine, 'PWM'):
+        try:
+            pwm = machine.PWM(machine.Pin(pin), freq=freq, duty_u16=0)
+        except Exception as e:
+            log(LOG_WARN, "PWM初始化失败，使用模拟后端: %s", e)
+    if pwm is None:
+        pwm = SimPWM(pin, freq)
+    led_data.update(pwm=pwm, duty=0)
+    return pwm
+
+
+def _led_fade_task():
+    """渐变线程：按固定步长逼近最新目标，到达后退出"""
+    led_config = config.get('LED', {})
+    step_ms = led_config.get('step_ms', 20)
+    max_step = 65535 * step_ms // max(led_config.get('fade_ms', 300), 1) or 1
+    pwm = led_data["pwm"]
+    while True:
+        with led_lock:
+            target = led_data["target"]
+            duty = led_data["duty"]
+            if duty == target:
+                led_data["fading"] = False
+                return
+            if abs(target - duty) <= max_step:
+                duty = target
+            elif target > duty:
+                duty += max_step
+            else:
+                duty -= max_step
+            led_data["duty"] = duty
+        pwm.duty_u16(duty)
+        utime.sleep_ms(step_ms)
+
+
+# -----------
+# 传感器采样
+# -----------
+sensor_data = {}  # 传感器名 -> 环形缓冲区及采样参数
+sensor_lock = _thread.allocate_lock()
+
+
+def sensor_register(name: str, func, interval: int = 1000, size: int = 120):
+    """
+    注册传感器（内存在注册时一次性分配，之后固定不变）
+    :param name: 传感器名称
+    :param func: 读取函数，返回数值
+    :param interval: 采样间隔（毫秒）
+    :param size: 环形缓冲区容量（采样点数）
+    """
+    sensor_data[name] = {
+        "func": func,
+        "interval": interval,
+        "size": size,
+        "values": uarray.array('f', [0] * size),
+        "ticks": uarray.array('L', [0] * size),
+        "pos": 0,  # 下一个写入位置
+        "count": 0,  # 有效采样数
+        "last": utime.ticks_ms(),
+        "errors": 0
+    }
+
+
+def _sensor_sample(sensor, now):
+    """读取一次传感器并写入环形缓冲区"""
+    try:
+        value = float(sensor["func"]())
+    except Exception:
+        sensor["errors"] += 1
+        return
+    with sensor_lock:
+        pos = sensor["pos"]
+        sensor["values"][pos] = value
+        sensor["ticks"][pos] = now
+        sensor["pos"] = (pos + 1) % sensor["size"]
+        if sensor["count"] < sensor["size"]:
+            sensor["count"] += 1
+
+
+def _sampler_task():
+    """后台采样线程：按各传感器间隔轮询，与客户端数量无关"""
+    while True:
+        now = utime.ticks_ms()
+        wait = 1000
+        for sensor in sensor_data.values():
+            interval = sensor["interval"] * power_factor()  # 无客户端时降低采样频率
+            remain = interval - utime.ticks_diff(now, sensor["last"])
+            if remain <= 0 or not sensor["count"]:
+                _sensor_sample(sensor, now)
+                sensor["last"] = now
+                remain = interval
+            wait = min(wait, remain)
+        utime.sleep_ms(max(wait, 10))
+
+
+def sensor_start():
+    """
+    按config.json中的SENSOR配置注册传感器并启动后台采样线程
+    """
+    for name, item in config.get('SENSOR', {}).items():
+        func = globals().get(item['func'])
+        if func is None:
+            log(LOG_ERROR, "传感器%s的读取函数%s未实现", name, item['func'])
+            continue
+        sensor_register(name, func, item.get('interval', 1000), item.get('size', 120))
+    if sensor_data:
+        _thread.start_new_thread(_sampler_task, ())
+
+
+def sensor_latest(name: str):
+    """
+    获取最近一次采样值
+    :return: 数值，无数据时为None
+    """
+    sensor = sensor_data.get(name)
+    if not sensor or not sensor["count"]:
+        return None
+    return sensor["values"][(sensor["pos"] - 1) % sensor["size"]]
+
+
+def _bucket_avg(series, points):
+    """分桶平均降采样"""
+    n = len(series)
+    out = []
+    for b in range(points):
+        start = b * n // points
+        end = (b + 1) * n // points
+        if end <= start:
+            continue
+        sx = sy = 0
+        for x, y in series[start:end]:
+            sx += x
+            sy += y
+        out.append((sx / (end - start), sy / (end - start)))
+    return out
+
+
+def _lttb(series, points):
+    """Largest-Triangle-Three-Buckets降采样（保留曲线形状，适合绘图）"""
+    n = len(series)
+    out = [series[0]]
+    every = (n - 2) / (points - 2)
+    a = 0
+    for i in range(points - 2):
+        # 下一个桶的平均点
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = avg_y = 0
+        for x, y in series[avg_start:avg_end]:
+            avg_x += x
+            avg_y += y
+        cnt = avg_end - avg_start
+        avg_x /= cnt
+        avg_y /= cnt
+        # 当前桶中与前一选中点、下一桶均值构成最大三角形的点
+        ax, ay = series[a]
+        best = -1
+        next_a = a
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = series[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best:
+                best = area
+                next_a = j
+        out.append(series[next_a])
+        a = next_a
+    out.append(series[-1])
+    return out
+
+
+def sensor_query(name: str, window: int = 60, points: int = 0, mode: str = "avg") -> dict:
+    """
+    查询传感器窗口统计与降采样序列
+    :param name: 传感器名称
+    :param window: 时间窗口（秒）
+    :param points: 降采样点数，0表示返回窗口内全部采样
+    :param mode: 降采样方式，"avg"分桶平均 / "lttb"
+    :return: {"min","max","mean","count","series":[[相对毫秒, 值], ...]}
+    """
+    sensor = sensor_data[name]
+    now = utime.ticks_ms()
+    limit = window * 1000
+    series = []
+    with sensor_lock:
+        pos = sensor["pos"]
+        for k in range(sensor["count"]):
+            i = (pos - 1 - k) % sensor["size"]
+            age = utime.ticks_diff(now, sensor["ticks"][i])
+            if age > limit:
+                break
+            series.append((-age, sensor["values"][i]))
+    series.reverse()  # 按时间先后排列
+
+    result = {"name": name, "window": window, "count": len(series),
+              "min": None, "max": None, "mean": None, "series": []}
+    if not series:
+        return result
+    total = 0
+    lo = hi = series[0][1]
+    for _, v in series:
+        total += v
+        if v < lo:
+            lo = v
+        elif v > hi:
+            hi = v
+    result.update(min=round(lo, 3), max=round(hi, 3), mean=round(total / len(series), 3))
+
+    if 0 < points < len(series):
+        if mode == "lttb" and points >= 3:
+            series = _lttb(series, points)
+        else:
+            series = _bucket_avg(series, points)
+    result["series"] = [[int(x), round(y, 3)] for x, y in series]
+    return result
+
+
+# -----------
+# 定时任务（时间轮）
+# -----------
+_sched_config = config.get('SCHEDULE', {})
+sched_data = {
+    "tick_ms": _sched_config.get('tick_ms', 100),  # 时间轮每格的时长
+    "slots": _sched_config.get('slots', 64),
+    "cursor": 0,
+    "running": False
+}
+SCHED_MAX_S = 5 * 86400  # 最长间隔：ticks_add/ticks_diff只支持2^29毫秒（约6.2天）以内
+sched_wheel = [[] for _ in range(sched_data["slots"])]
+sched_jobs = {}  # 任务ID -> 任务
+sched_lock = _thread.allocate_lock()
+
+
+def _time_synced() -> bool:
+    return utime.localtime()[0] >= 2024  # 未同步时时钟从2000年开始
+
+
+def time_sync() -> bool:
+    """
+    通过NTP校准时钟（需STA已联网；at定时任务在校时前不会执行）
+    :return: 是否成功
+    """
+    if ntptime is None or not STA.isconnected():
+        return False
+    ntptime.host = _sched_config.get('ntp_host', 'pool.ntp.org')
+    try:
+        ntptime.settime()
+    except Exception as e:
+        log(LOG_WARN, "NTP校时失败: %s", e)
+        return False
+    log(LOG_INFO, "NTP校时完成")
+    return True
+
+
+def _sched_insert(job, delay_ms: int):
+    """
+    把任务放入时间轮（O(1)）：落在delay_ms后对应的格子，绕轮圈数记在rounds
+    """
+    ticks = max(1, (delay_ms + sched_data["tick_ms"] - 1) // sched_data["tick_ms"])
+    with sched_lock:
+        slot = (sched_data["cursor"] + ticks) % sched_data["slots"]
+        job["rounds"] = (ticks - 1) // sched_data["slots"]
+        job["queued"] = utime.ticks_ms()
+        job["delay_ms"] = delay_ms
+        sched_wheel[slot].append(job)
+
+
+def _sched_next_delay(job) -> int:
+    """
+    计算任务下次执行的延迟（毫秒）
+    """
+    if job["every"]:
+        return min(job["every"] * (power_factor() if job["backoff"] else 1), SCHED_MAX_S) * 1000
+    if job["at"]:
+        if not _time_synced():
+            return 60 * 1000  # 时间未同步，一分钟后再检查
+        t = utime.localtime(utime.time() + _sched_config.get('utc_offset', 0) * 3600)
+        hour, minute = job["at"].split(':')
+        wait = (int(hour) * 3600 + int(minute) * 60 - (t[3] * 3600 + t[4] * 60 + t[5])) % 86400
+        return (wait or 86400) * 1000
+    return job["delay"] * 1000
+
+
+def sched_add(job_id: str, fun, every: int = 0, delay: int = 0, at: str = "", args=(), backoff: bool = True) -> str:
+    """
+    添加定时任务
+    :param job_id: 任务ID（重复时替换原任务）
+    :param fun: fun_config中的功能ID，或直接传入函数（内部任务）
+    :param every: 周期执行间隔（秒）
+    :param delay: 延迟执行一次（秒）
+    :param at: 每天定时执行，"HH:MM"（需时间已同步）
+    :param args: 调用参数
+    :param backoff: 周期任务在空闲时是否按POWER.backoff倍数降频
+    :return: 成功信息或错误提示
+    """
+    if sum(1 for x in (every, delay, at) if x) != 1:
+        return "错误：every/delay/at需且只能指定一个"
+    if every < 0 or delay < 0:
+        return "错误：秒数需大于0"
+    if every > SCHED_MAX_S or delay > SCHED_MAX_S:
+        return f"错误：秒数不能超过{SCHED_MAX_S}"
+    if not callable(fun) and fun not in fun_config:
+        return f"错误：功能{fun}不存在"
+    if at:
+        try:
+            hour, minute = at.split(':')
+            if not (0 <= int(hour) < 24 and 0 <= int(minute) < 60):
+                raise ValueError
+        except ValueError:
+            return "错误：时间格式需为HH:MM"
+    sched_cancel(job_id)
+    job = {
+        "id": job_id,
+        "fun": fun,
+        "args": list(args),
+        "every": every,
+        "delay": delay,
+        "at": at,
+        "backoff": backoff,
+        "runs": 0,
+        "last_result": "",
+        "cancelled": False
+    }
+    sched_jobs[job_id] = job
+    _sched_insert(job, _sched_next_delay(job))
+    return f"任务{job_id}已添加"
+
+
+def sched_cancel(job_id: str) -> bool:
+    """
+    取消任务（只做标记，时间轮转到该格时丢弃，O(1)）
+    """
+    job = sched_jobs.pop(job_id, None)
+    if job is None:
+        return False
+    job["cancelled"] = True
+    return True
+
+
+def _sched_run(job):
+    """执行到期任务并重新排期"""
+    if job["at"] and not _time_synced():
+        _sched_insert(job, _sched_next_delay(job))
+        return
+    fun = job["fun"]
+    try:
+        func = fun if callable(fun) else globals()[fun_config[fun]['name']]
+    except KeyError:
+        # 功能已被删除（如批量配置remove_function），取消任务而不是让时间轮线程退出
+        log(LOG_WARN, "定时任务%s的功能%s已不存在，任务取消", job["id"], fun)
+        sched_cancel(job["id"])
+        return
+    try:
+        job["last_result"] = str(func(*job["args"]))[:80]
+    except Exception as e:
+        job["last_result"] = f"异常: {str(e)}"
+        log(LOG_ERROR, "定时任务%s异常: %s", job["id"], e)
+    job["runs"] += 1
+    if job["cancelled"]:
+        return
+    if job["delay"]:
+        sched_jobs.pop(job["id"], None)  # 一次性任务
+    else:
+        _sched_insert(job, _sched_next_delay(job))
+
+
+def _sched_task():
+    """时间轮线程：每格处理一个槽，到期任务在本线程执行，不阻塞网页服务"""
+    next_tick = utime.ticks_ms()
+    while True:
+        next_tick = utime.ticks_add(next_tick, sched_data["tick_ms"])
+        wait = utime.ticks_diff(next_tick, utime.ticks_ms())
+        if wait > 0:
+            utime.sleep_ms(wait)
+        due = []
+        with sched_lock:
+            cursor = (sched_data["cursor"] + 1) % sched_data["slots"]
+            sched_data["cursor"] = cursor
+            bucket = sched_wheel[cursor]
+            sched_wheel[cursor] = []
+            for job in bucket:
+                if job["cancelled"]:
+                    continue
+                if job["rounds"]:
+                    job["rounds"] -= 1
+                    sched_wheel[cursor].append(job)
+                else:
+                    due.append(job)
+        for job in due:
+            try:
+                _sched_run(job)
+            except Exception as e:
+                # 重新排期失败也不能让时间轮线程退出（内部任务依赖它）
+                log(LOG_ERROR, "定时任务%s调度异常: %s", job["id"], e)
+
+
+def sched_start():
+    """
+    按config.json中的SCHEDULE配置添加任务并启动时间轮线程
+    """
+    for item in _sched_config.get('jobs', []):
+        if not item.get('enabled', True):
+            continue
+        result = sched_add(item['id'], item['fun'], item.get('every', 0), item.get('delay', 0),
+                           item.get('at', ""), item.get('args', ()), item.get('backoff', True))
+        if result.startswith("错误"):
+            log(LOG_ERROR, "定时任务%s配置无效: %s", item['id'], result)
+    if not sched_data["running"]:
+        sched_data["running"] = True
+        _thread.start_new_thread(_sched_task, ())
+    # 每天重新校时，修正RTC漂移
+    sched_add("_ntp", time_sync, every=86400, backoff=False)
+
+
+def job_status() -> str:
+    """
+    定时任务列表
+    """
+    if not sched_jobs:
+        return "🟢 无定时任务"
+    rows = ["<table><tr><th>ID</th><th>功能</th><th>计划</th><th>下次(s)</th><th>次数</th><th>上次结果</th></tr>"]
+    now = utime.ticks_ms()
+    for job_id in sorted(sched_jobs):
+        job = sched_jobs[job_id]
+        if job["every"]:
+            plan = f"每{job['every']}s"
+        elif job["at"]:
+            plan = f"每天{job['at']}"
+        else:
+            plan = f"{job['delay']}s后"
+        fun = job["fun"] if not callable(job["fun"]) else "(内部)"
+        rows.append(f"<tr><td>{job_id}</td><td>{fun}</td><td>{plan}</td>"
+                    f"<td>{(job['delay_ms'] - utime.ticks_diff(now, job['queued'])) // 1000}</td><td>{job['runs']}</td>"
+                    f"<td>{job['last_result']}</td></tr>")
+    rows.append("</table>")
+    return "".join(rows)
+
+
+def schedule_job(job_id: str, fun: str, when: str, args: str) -> str:
+    """
+    通过网页添加定时任务（不写入config.json，重启后失效）
+    :param job_id: 任务ID
+    :param fun: 功能ID
+    :param when: "every:秒" / "delay:秒" / "at:HH:MM"
+    :param args: 逗号分隔的参数
+    """
+    kind, _, value = when.partition(':')
+    args = [a.strip() for a in args.split(',')] if args.strip() else []
+    try:
+        if kind == "every":
+            return sched_add(job_id, fun, every=int(value), args=args)
+        if kind == "delay":
+            return sched_add(job_id, fun, delay=int(value), args=args)
+    except ValueError:
+        return "错误：秒数需为整数"
+    if kind == "at":
+        return sched_add(job_id, fun, at=value, args=args)
+    return "错误：计划格式需为every:秒/delay:秒/at:HH:MM"
+
+
+def cancel_job(job_id: str) -> str:
+    """
+    取消定时任务
+    """
+    if sched_cancel(job_id.strip()):
+        return f"任务{job_id}已取消"
+    return f"错误：任务{job_id}不存在"
+
+
+# -----------
+# 空闲节能
+# -----------
+_power_config = config.get('POWER', {})
+power_data = {
+    "enabled": _power_config.get('enabled', True),
+    "idle": False,
+    "last_request": utime.ticks_ms(),
+    "clients": {},  # 客户端IP -> 最近请求的ticks_ms
+    "changes": {}  # show功能ID -> [ETag, 最近变化的ticks_ms]
+}
+
+
+def _power_set(idle: bool):
+    """切换CPU频率与WLAN省电模式"""
+    power_data["idle"] = idle
+    try:
+        machine.freq(_power_config.get('freq_low' if idle else 'freq_high', 80000000 if idle else 240000000))
+    except Exception as e:
+        log(LOG_WARN, "调整CPU频率失败: %s", e)
+    pm = getattr(network.WLAN, 'PM_POWERSAVE' if idle else 'PM_NONE', None)
+    if pm is not None and STA.active():
+        try:
+            STA.config(pm=pm)
+        except Exception as e:
+            log(LOG_WARN, "调整WLAN省电模式失败: %s", e)
+    log(LOG_INFO, "进入空闲节能模式" if idle else "退出空闲节能模式")
+
+
+def power_touch(ip: str):
+    """
+    每个请求调用：记录客户端活动，空闲状态下立即恢复全速
+    """
+    now = utime.ticks_ms()
+    power_data["last_request"] = now
+    power_data["clients"][ip] = now
+    if power_data["idle"]:
+        _power_set(False)
+
+
+def power_factor() -> int:
+    """
+    后台任务降频倍数：近期有客户端时为1，空闲时为POWER.backoff
+    """
+    if not power_data["enabled"]:
+        return 1
+    idle_ms = _power_config.get('idle_s', 60) * 1000
+    if utime.ticks_diff(utime.ticks_ms(), power_data["last_request"]) < idle_ms:
+        return 1
+    return _power_config.get('backoff', 4)
+
+
+def active_clients(window_ms: int = 10000) -> int:
+    """
+    最近window_ms内有请求的客户端数量
+    """
+    now = utime.ticks_ms()
+    return sum(1 for t in power_data["clients"].values() if utime.ticks_diff(now, t) < window_ms)
+
+
+def poll_interval(group_id: str, etag: str) -> int:
+    """
+    建议的show轮询间隔（毫秒）：内容越久未变化间隔越长，客户端多时按负载放大
+    """
+    poll_min = _power_config.get('poll_min', 370)
+    if not power_data["enabled"]:
+        return poll_min
+    now = utime.ticks_ms()
+    change = power_data["changes"].get(group_id)
+    if change is None or change[0] != etag:
+        power_data["changes"][group_id] = [etag, now]
+        return poll_min
+    # 每个变化窗口内没有变化，间隔翻倍
+    windows = utime.ticks_diff(now, change[1]) // (_power_config.get('change_window_s', 5) * 1000)
+    interval = poll_min << min(windows, 5)
+    clients = active_clients()
+    if clients > 2:
+        interval = interval * clients // 2
+    return min(interval, _power_config.get('poll_max', 5000))
+
+
+def _power_tick():
+    """内部定时任务：长时间无请求时降频进入省电模式，并清理过期客户端记录"""
+    now = utime.ticks_ms()
+    idle_ms = _power_config.get('idle_s', 60) * 1000
+    if not power_data["idle"] and utime.ticks_diff(now, power_data["last_request"]) >= idle_ms:
+        _power_set(True)
+    for ip in [ip for ip, t in power_data["clients"].items() if utime.ticks_diff(now, t) >= idle_ms]:
+        del power_data["clients"][ip]
+
+
+def power_start():
+    """
+    按POWER配置启动空闲检测
+    """
+    if power_data["enabled"]:
+        sched_add("_power", _power_tick, every=1, backoff=False)
+
+
+# -----------
+# AP信道选择
+# -----------
+_channel_config = config.get('CHANNEL', {})
+channel_data = {
+    "channel": 0,  # 当前AP信道
+    "since": 0,  # 切换到当前信道的ticks_ms
+    "scores": {}  # 最近一次评估的 信道 -> 拥挤度
+}
+CHANNEL_OVERLAP = (100, 75, 50, 25, 10)  # 相距0~4个信道的频谱重叠权重（%），相距5个及以上不重叠
+
+
+def channel_scan() -> list:
+    """
+    同步扫描周边AP
+    :return: [(信道, RSSI), ...]
+    """
+    original_active = STA.active()
+    try:
+        if not original_active:
+            STA.active(True)
+            utime.sleep_ms(300)
+        aps = [(ap[2], ap[3]) for ap in STA.scan()]
+    finally:
+        if not original_active:
+            STA.active(False)
+    scan_data.update(aps=aps, aps_ticks=utime.ticks_ms())
+    return aps
+
+
+def channel_scores(aps: list) -> dict:
+    """
+    计算候选信道的拥挤度：每个AP按信号强度（RSSI+100，下限0）乘以与候选信道的重叠权重累加
+    :param aps: [(信道, RSSI), ...]
+    :return: 信道 -> 拥挤度（越小越空闲）
+    """
+    scores = {}
+    for channel in _channel_config.get('candidates', [1, 6, 11]):
+        score = 0
+        for ap_channel, rssi in aps:
+            distance = abs(ap_channel - channel)
+            if distance < len(CHANNEL_OVERLAP):
+                score += CHANNEL_OVERLAP[distance] * max(0, rssi + 100)
+        scores[channel] = score // 100
+    return scores
+
+
+def channel_pick() -> int:
+    """
+    选择AP信道；STA已连接时AP只能与STA同信道
+    AP已在运行（如网页修改AP配置）时沿用当前信道，不在请求处理中扫描，重新选择交给_channel_task；
+    只有启动时（网页服务开始前）才同步扫描
+    """
+    if STA.isconnected():
+        return STA.config("channel")
+    if channel_data["channel"]:
+        return channel_data["channel"]
+    aps = scan_data["aps"]
+    if not scan_data["aps_ticks"]:
+        try:
+            aps = channel_scan()
+        except Exception as e:
+            log(LOG_WARN, "信道扫描失败: %s", e)
+    scores = channel_scores(aps)
+    channel_data["scores"] = scores
+    return min(scores, key=lambda c: (scores[c], c))
+
+
+def _channel_task():
+    """后台重新评估：周边变化足够大且满足最短停留时间时才切换信道，避免来回切换"""
+    ap = config['WIFI']['ap']
+    if scan_data["status"] == "scanning" or STA.isconnected():
+        return
+    try:
+        scores = channel_scores(channel_scan())
+    except Exception as e:
+        log(LOG_WARN, "信道扫描失败: %s", e)
+        return
+    channel_data["scores"] = scores
+    current = channel_data["channel"]
+    best = min(scores, key=lambda c: (scores[c], c))
+    if best == current or current not in scores:
+        return
+    # 新信道需比当前信道空闲margin_pct%以上，且差值不小于margin_min，避免微小波动引起切换
+    if scores[best] * 100 > scores[current] * (100 - _channel_config.get('margin_pct', 25)):
+        return
+    if scores[current] - scores[best] < _channel_config.get('margin_min', 20):
+        return
+    if utime.ticks_diff(utime.ticks_ms(), channel_data["since"]) < _channel_config.get('min_dwell_s', 1800) * 1000:
+        return
+    # 切换信道会断开已连接的客户端，有人使用时推迟
+    if active_clients(_channel_config.get('quiet_s', 60) * 1000):
+        log(LOG_INFO, "信道%d更空闲，客户端活跃中，暂不切换", best)
+        return
+    log(LOG_INFO, "AP信道切换: %d(%d) -> %d(%d)", current, scores[current], best, scores[best])
+    ap_start(ap['ssid'], ap['encryption'], ap['password'], best)
+
+
+def channel_check():
+    """
+    定时任务：在后台线程中扫描并重新评估AP信道
+    """
+    if config['WIFI']['ap'].get('channel', "auto") == "auto":
+        _thread.start_new_thread(_channel_task, ())
+
+
+def channel_start():
+    """
+    AP信道为auto时启动定期重新评估
+    """
+    interval = _channel_config.get('interval_s', 900)
+    if interval:
+        sched_add("_channel", channel_check, every=interval)
+
+
+# -----------
+# 身份验证
+# -----------
+LOGIN_FORM = """<div class="group"><h3>🔒 管理登录</h3>
+    <form onsubmit="handleLogin(event)">
+    <input type="password" name="password" placeholder="管理密码"><br>
+    <input type="submit" value="登录"> <button type="button" onclick="handleLogout()">退出</button>
+    <br><input type="text" id="login_result" readonly></form></div>"""
+LOGIN_JS = """
+        function handleLogin(event) {
+            event.preventDefault();
+            fetch('/login', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/x-www-form-urlencoded'},
+                body: new URLSearchParams(new FormData(event.target))
+            })
+            .then(r => r.ok ? location.reload() : r.text().then(t => document.getElementById('login_result').value = t))
+        }
+
+        function handleLogout() {
+            fetch('/logout', {method: 'POST'}).then(() => location.reload())
+        }
+    """
+auth_secret = uos.urandom(32)  # 每次启动重新生成，重启后所有会话失效
+auth_sessions = {}  # 随机数 -> (令牌, 签发时的ticks_ms)
+
+
+def _sha256_hex(data: bytes) -> str:
+    return ubinascii.hexlify(uhashlib.sha256(data).digest()).decode()
+
+
+def hmac_sha256(key: bytes, msg: bytes) -> bytes:
+    """
+    HMAC-SHA256（MicroPython无hmac模块）
+    """
+    if len(key) > 64:
+        key = uhashlib.sha256(key).digest()
+    key = key + b'\x00' * (64 - len(key))
+    inner = uhashlib.sha256(bytes(b ^ 0x36 for b in key))
+    inner.update(msg)
+    outer = uhashlib.sha256(bytes(b ^ 0x5c for b in key))
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+def ct_equal(a: str, b: str) -> bool:
+    """
+    常量时间字符串比较
+    """
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for x, y in zip(a, b):
+        diff |= ord(x) ^ ord(y)
+    return diff == 0
+
+
+def _session_ttl_ms() -> int:
+    # ticks_diff只在2^29毫秒（约6.2天）内有效
+    return min(config.get('AUTH', {}).get('ttl', 3600), 6 * 86400) * 1000
+
+
+def _session_prune(now: int):
+    """删除已过期的会话（有效期按ticks_ms计算，NTP校时造成的时钟跳变不影响）"""
+    ttl_ms = _session_ttl_ms()
+    for nonce in [k for k, v in auth_sessions.items() if not 0 <= utime.ticks_diff(now, v[1]) <= ttl_ms]:
+        del auth_sessions[nonce]
+
+
+def session_issue() -> str:
+    """
+    签发会话令牌：<签发ticks_ms>.<随机数>.<HMAC签名>
+    """
+    now = utime.ticks_ms()
+    nonce = ubinascii.hexlify(uos.urandom(8)).decode()
+    payload = f"{now}.{nonce}"
+    token = payload + "." + ubinascii.hexlify(hmac_sha256(auth_secret, payload.encode())[:16]).decode()
+    _session_prune(now)
+    # 会话数达到上限时淘汰最早签发的
+    if len(auth_sessions) >= config.get('AUTH', {}).get('max_sessions', 8):
+        oldest = max(auth_sessions, key=lambda k: utime.ticks_diff(now, auth_sessions[k][1]))
+        del auth_sessions[oldest]
+    auth_sessions[nonce] = (token, now)
+    return token
+
+
+def session_valid(token: str) -> bool:
+    """
+    校验会话令牌（查缓存后做一次常量时间比较，不重新计算密码哈希或签名）
+    """
+    parts = token.split('.')
+    if len(parts) != 3:
+        return False
+    # 每次校验都清理过期会话（最多max_sessions个），避免长期不用的会话在ticks回绕后复活
+    _session_prune(utime.ticks_ms())
+    entry = auth_sessions.get(parts[1])
+    if entry is None:
+        return False
+    return ct_equal(entry[0], token)
+
+
+def session_revoke(token: str):
+    parts = token.split('.')
+    if len(parts) == 3:
+        auth_sessions.pop(parts[1], None)
+
+
+def _session_token(request: str) -> str:
+    for item in get_header(request, 'Cookie').split(';'):
+        key, _, value = item.strip().partition('=')
+        if key == 'session':
+            return value
+    return ""
+
+
+def auth_check(request: str) -> bool:
+    """
+    请求是否允许执行：未启用验证时全部允许；
+    启用后写操作需要有效会话，只读请求在public_read为true时公开
+    （/show/<id>仅当该功能组类型为show时算只读）
+    """
+    auth_config = config.get('AUTH', {})
+    if not auth_config.get('enabled'):
+        return True
+    method, path = request_line(request)
+    if method == 'GET' and auth_config.get('public_read', True):
+        if not path.startswith('/show/'):
+            return True
+        group = fun_config.get(path[len('/show/'):].split('?')[0])
+        if group and group['type'] == 'show':
+            return True
+    return session_valid(_session_token(request))
+
+
+def auth_handle(conn, request: str):
+    """
+    处理POST /login（body: password=...）与POST /logout
+    """
+    if request.startswith('POST /logout'):
+        session_revoke(_session_token(request))
+        conn.send('HTTP/1.1 200 OK\r\nSet-Cookie: session=; Path=/; Max-Age=0\r\n'
+                  'Content-Type: text/plain; charset=utf-8\r\n\r\n已退出')
+        return
+    auth_config = config.get('AUTH', {})
+    password = parse_params(read_body(request)).get('password', '')
+    expected = auth_config.get('hash', '')
+    if not expected or not ct_equal(_sha256_hex((auth_config.get('salt', '') + password).encode()), expected):
+        log(LOG_WARN, "登录失败")
+        conn.send('HTTP/1.1 401 Unauthorized\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n错误：密码错误')
+        return
+    token = session_issue()
+    log(LOG_INFO, "登录成功，当前会话数%d", len(auth_sessions))
+    conn.send(f'HTTP/1.1 200 OK\r\nSet-Cookie: session={token}; Path=/; HttpOnly; SameSite=Strict; '
+              f'Max-Age={auth_config.get("ttl", 3600)}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n登录成功')
+
+
+def auth_setup(password: str, enabled: str, public_read: str) -> str:
+    """
+    设置管理密码并开关身份验证（修改后所有会话失效）
+    :param password: 新密码，至少8个字符；留空保留原密码
+    :param enabled: 1/0
+    :param public_read: 1/0，只读面板是否无需登录
+    :return: 成功信息或错误提示
+    """
+    auth_config = config.setdefault('AUTH', {})
+    if enabled not in ("0", "1") or public_read not in ("0", "1"):
+        return "错误：enabled和public_read需为1或0"
+    if password:
+        if len(password) < 8:
+            return "错误：密码至少8个字符"
+        salt = ubinascii.hexlify(uos.urandom(8)).decode()
+        auth_config.update(salt=salt, hash=_sha256_hex((salt + password).encode()))
+    if enabled == "1" and not auth_config.get('hash'):
+        return "错误：启用验证前需设置密码"
+    auth_config.update(enabled=enabled == "1", public_read=public_read == "1")
+    save_config()
+    auth_sessions.clear()
+    return f"身份验证：{'开启' if enabled == '1' else '关闭'}，只读面板{'公开' if public_read == '1' else '需登录'}"
+
+
+def login_html() -> str:
+    """
+    只读面板不公开时，未登录访问首页返回的登录页
+    """
+    return ('<html><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1">'
+            '<script>' + LOGIN_JS + '</script></head><body>' + LOGIN_FORM + '</body></html>')
+
+
 # -----------
 # 网页生成函数
 # -----------
@@ -747,7 +2045,7 @@ def generate_html():
             border-bottom: 1px solid #eee;
             font-size: 1.2em;
         }
-        input[type="text"] {
+        input[type="text"], input[type="password"] {
             width: 100%;
             padding: 8px;
             margin: 8px 0;
@@ -816,10 +2114,18 @@ def generate_html():
         }        
     </style>
     <script>
+        const showTags = {};
         function updateShow(id) {
-            fetch('/show/' + id)
-            .then(r => r.text())
-            .then(t => document.getElementById(id).innerHTML = t)
+            const headers = showTags[id] ? {'If-None-Match': showTags[id]} : {};
+            fetch('/show/' + id, {headers: headers, cache: 'no-store'})
+            .then(r => {
+                // 按服务器建议的间隔安排下次轮询
+                setTimeout(() => updateShow(id), parseInt(r.headers.get('X-Poll-Interval')) || 370);
+                if (r.status === 304) return;  // 内容未变化，跳过DOM更新
+                showTags[id] = r.headers.get('ETag');
+                return r.text().then(t => document.getElementById(id).innerHTML = t);
+            })
+            .catch(() => setTimeout(() => updateShow(id), 5000))
         }
         
         function handleRutSubmit(event, groupId) {
@@ -837,7 +2143,9 @@ def generate_html():
             .then(r => r.text())
             .then(t => document.getElementById(groupId + '_result').value = t)
         }
-    </script></head><body>"""
+    """ + LOGIN_JS + """</script></head><body>"""
+    if config.get('AUTH', {}).get('enabled'):
+        html += LOGIN_FORM
     # 获取所有已定义的函数名
     available_functions = set(globals().keys())
 
@@ -889,7 +2197,7 @@ def generate_html():
 
         elif group['type'] == 'show':
             html += f'<div class="output" id="{group_id}">Loading...</div>'
-            html += f'<script>setInterval(() => updateShow("{group_id}"), 370)</script>'
+            html += f'<script>updateShow("{group_id}")</script>'
 
         elif group['type'] == 'rut':
             html += f'<form onsubmit="handleRutSubmit(event, \'{group_id}\')">'
@@ -902,84 +2210,869 @@ def generate_html():
     return html + "</body></html>"
 
 
+# -----------
+# 响应压缩
+# -----------
+def accepted_encoding(accept: str):
+    """
+    根据Accept-Encoding选择压缩方式
+    :return: "gzip" | "deflate" | None
+    """
+    if deflate is None or not accept:
+        return None
+    offered = []
+    for item in accept.split(','):
+        token, _, q = item.strip().partition(';')
+        if q.replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        offered.append(token.strip().lower())
+    for encoding in ('gzip', 'deflate'):
+        if encoding in offered:
+            return encoding
+    return None
+
+
+def compress_body(data: bytes, encoding: str):
+    """
+    压缩响应body
+    :param encoding: "gzip" 或 "deflate"（HTTP的deflate即zlib格式）
+    :return: 压缩后的bytes，固件不支持压缩时返回None
+    """
+    buf = uio.BytesIO()
+    fmt = deflate.GZIP if encoding == 'gzip' else deflate.ZLIB
+    try:
+        with deflate.DeflateIO(buf, fmt, config.get('HTTP', {}).get('compress_wbits', 10)) as d:
+            d.write(data)
+    except (OSError, ValueError, NotImplementedError):
+        return None
+    return buf.getvalue()
+
+
+def send_response(conn, request: str, body, content_type: str = "text/plain; charset=utf-8", cache_key=None,
+                  etag=None, headers: str = ""):
+    """
+    发送200响应，客户端支持时压缩超过阈值的body
+    :param conn: 客户端连接
+    :param request: 原始请求字符串（读取Accept-Encoding）
+    :param body: 响应内容；传入函数时仅在缓存未命中时调用
+    :param content_type: Content-Type
+    :param cache_key: 可缓存页面的键，压缩结果在配置变更前复用
+    :param etag: 实体标签，附加ETag头供客户端条件请求
+    :param headers: 附加的响应头（每行以CRLF结尾）
+    """
+    http_config = config.get('HTTP', {})
+    compress = http_config.get('compress', True)
+    requested = accepted_encoding(get_header(request, 'Accept-Encoding')) if compress else None
+
+    cached = page_cache.get(f"{cache_key}|{requested}") if cache_key is not None else None
+    if cached and cached[0] == config_version:
+        data, encoding = cached[1], cached[2]
+    else:
+        if callable(body):
+            t = trace_begin()
+            body = body()
+            trace_end("render", t)
+        data = body.encode() if isinstance(body, str) else body
+        encoding = None
+        if requested and len(data) >= http_config.get('compress_min', 512):
+            t = trace_begin()
+            packed = compress_body(data, requested)
+            trace_end("compress", t)
+            if packed is not None and len(packed) < len(data):
+                data, encoding = packed, requested
+        if cache_key is not None and encoding:
+            # 未压缩的版本按需重新生成，不常驻内存
+            page_cache[f"{cache_key}|{requested}"] = (config_version, data, encoding)
+
+    header = f'HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\n'
+    if encoding:
+        header += f'Content-Encoding: {encoding}\r\n'
+    if compress:
+        header += 'Vary: Accept-Encoding\r\n'
+    if etag:
+        header += f'ETag: {etag}\r\nCache-Control: no-cache\r\n'
+    header += headers
+    t = trace_begin()
+    conn.send(header + '\r\n')
+    conn.send(data)
+    trace_end("send", t)
+
+
+def make_etag(body: str) -> str:
+    """
+    计算响应内容的ETag（CRC32）
+    """
+    return '"%08x"' % (ubinascii.crc32(body.encode()) & 0xffffffff)
+
+
+# -----------
+# 在线更新(OTA)
+# -----------
+OTA_PENDING = 'ota_pending.json'  # 待确认的更新记录，boot.py据此回滚
+ota_data = {"config_replaced": False}  # config.json已被替换，等待重启加载
+
+
+def _ota_reply(conn, status: str, message: str):
+    conn.send(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n{message}')
+
+
+def _ota_pending() -> dict:
+    try:
+        with open(OTA_PENDING) as f:
+            return ujson.load(f)
+    except (OSError, ValueError):
+        return {"files": [], "boots": 0}
+
+
+def _ota_swap(target: str):
+    """
+    用暂存文件替换目标文件，原文件保留为.bak
+    同一轮待确认更新中重复上传时保留最初的备份
+    """
+    pending = _ota_pending()
+    first_update = target not in pending["files"]
+    if first_update:
+        pending["files"].append(target)
+    pending["boots"] = 0
+    # 先记录再替换，替换过程中断电也能由boot.py恢复
+    with open(OTA_PENDING, 'w') as f:
+        ujson.dump(pending, f)
+
+    backup = target + '.bak'
+    if first_update:
+        try:
+            uos.remove(backup)
+        except OSError:
+            pass
+        try:
+            uos.rename(target, backup)
+        except OSError:
+            pass  # 新增文件，无原版本
+    else:
+        try:
+            uos.remove(target)
+        except OSError:
+            pass
+    uos.rename(target + '.new', target)
+
+
+def ota_confirm():
+    """
+    新版本启动成功后确认更新（删除待确认记录，boot.py不再回滚）
+    """
+    try:
+        uos.remove(OTA_PENDING)
+        log(LOG_INFO, "OTA更新已确认")
+    except OSError:
+        pass
+
+
+def ota_upload(conn, raw: bytes):
+    """
+    流式接收上传文件：POST /upload/<文件名>?sha256=<十六进制摘要>[&reboot=1]
+    body按块写入flash暂存文件并同时计算SHA-256，校验通过后替换原文件
+    :param conn: 客户端连接
+    :param raw: 首次recv得到的数据（请求头及部分body）
+    """
+    head, sep, chunk = raw.partition(b'\r\n\r\n')
+    if not sep:
+        return _ota_reply(conn, '400 Bad Request', "错误：请求头过长")
+    head = head.decode()
+    path = head.split()[1]
+    target, _, query = path[len('/upload/'):].partition('?')
+    params = parse_params(query)
+
+    ota_config = config.get('OTA', {})
+    allowed = ota_config.get('files', ["main.py", "config.json"])
+    if target not in allowed and not (ota_config.get('allow_mpy', True) and target.endswith('.mpy')
+                                      and '/' not in target):
+        return _ota_reply(conn, '403 Forbidden', f"错误：不允许更新{target}")
+    expected = (params.get('sha256') or get_header(head, 'X-Content-SHA256')).lower()
+    if len(expected) != 64:
+        return _ota_reply(conn, '400 Bad Request', "错误：缺少sha256校验值")
+    try:
+        length = int(get_header(head, 'Content-Length'))
+    except ValueError:
+        return _ota_reply(conn, '411 Length Required', "错误：缺少Content-Length")
+
+    staging = target + '.new'
+    digest = uhashlib.sha256()
+    received = 0
+    try:
+        with open(staging, 'wb') as f:
+            while True:
+                if chunk:
+                    chunk = chunk[:length - received]
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+                if received >= length:
+                    break
+                chunk = conn.recv(min(1024, length - received))
+                if not chunk:
+                    break
+    except OSError as e:
+        # flash已满等写入错误
+        try:
+            uos.remove(staging)
+        except OSError:
+            pass
+        log(LOG_ERROR, "OTA写入%s失败: %s", staging, e)
+        return _ota_reply(conn, '500 Internal Server Error', f"错误：写入失败：{str(e)}")
+
+    actual = ubinascii.hexlify(digest.digest()).decode()
+    error = None
+    if received != length:
+        error = f"错误：数据不完整（{received}/{length}字节）"
+    elif actual != expected:
+        error = f"错误：SHA-256校验失败（{actual}）"
+    elif target == 'config.json':
+        try:
+            with open(staging) as f:
+                ujson.load(f)
+        except ValueError:
+            error = "错误：config.json格式无效"
+    if error:
+        uos.remove(staging)
+        return _ota_reply(conn, '400 Bad Request', error)
+
+    if target == 'config.json':
+        ota_data["config_replaced"] = True
+    _ota_swap(target)
+    log(LOG_INFO, "OTA: %s %d字节 sha256=%s", target, length, actual)
+    # 运行中的配置已与文件不一致，config.json更新后总是重启
+    if params.get('reboot') == '1' or target == 'config.json':
+        _ota_reply(conn, '200 OK', f"{target}已更新，正在重启")
+        conn.close()
+        utime.sleep_ms(300)
+        machine.reset()
+    else:
+        _ota_reply(conn, '200 OK', f"{target}已更新，重启后生效")
+
+
+# -----------
+# 设备发现与集群状态
+# -----------
+fleet_data = {
+    "status": "idle",  # idle/collecting/ready/error
+    "peers": {},  # 设备ID -> 状态摘要
+    "last_update": 0
+}
+_manifest_cache = [-1, ""]  # [配置版本, 功能清单版本]
+
+
+def device_id() -> str:
+    return ubinascii.hexlify(machine.unique_id()).decode()
+
+
+def manifest_version() -> str:
+    """
+    功能清单版本（功能列表与定义的CRC32，配置变更后重新计算）
+    """
+    if _manifest_cache[0] != config_version:
+        manifest = ujson.dumps([config['function_list'], [(k, fun_config[k]) for k in sorted(fun_config)]])
+        _manifest_cache[0] = config_version
+        _manifest_cache[1] = '%08x' % (ubinascii.crc32(manifest.encode()) & 0xffffffff)
+    return _manifest_cache[1]
+
+
+def fleet_digest() -> dict:
+    """
+    本机紧凑状态摘要
+    """
+    connected = STA.isconnected()
+    return {
+        "id": device_id(),
+        "ip": STA.ifconfig()[0] if connected else AP.ifconfig()[0],
+        "mv": manifest_version(),
+        "sta": sta_data["status"],
+        "rssi": STA.status("rssi") if connected else 0,
+        "up": utime.ticks_ms() // 1000,
+        "mem": gc.mem_free()
+    }
+
+
+def _fleet_hello() -> dict:
+    digest = fleet_digest()
+    return {"id": digest["id"], "ip": digest["ip"], "mv": digest["mv"]}
+
+
+def udp_serve(port: int, handler, size: int = 512):
+    """
+    在后台线程运行UDP服务
+    :param port: 监听端口
+    :param handler: handler(data, addr)，返回要回复的bytes，None表示不回复
+    :param size: 最大报文长度
+    """
+    sock = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+    sock.setsockopt(usocket.SOL_SOCKET, usocket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', port))
+
+    def _serve_task():
+        while True:
+            try:
+                data, addr = sock.recvfrom(size)
+                reply = handler(data, addr)
+                if reply:
+                    sock.sendto(reply, addr)
+            except Exception as e:
+                log(LOG_ERROR, "UDP服务%d异常: %s", port, e)
+
+    _thread.start_new_thread(_serve_task, ())
+    return sock
+
+
+def _fleet_handle(data, addr):
+    """
+    响应发现请求：{"q":"hello"}返回设备ID/IP/清单版本，{"q":"status"}返回完整摘要
+    """
+    try:
+        query = ujson.loads(data).get("q")
+    except (ValueError, AttributeError):
+        return None
+    if query == "hello":
+        return ujson.dumps(_fleet_hello())
+    if query == "status":
+        return ujson.dumps(fleet_digest())
+    return None
+
+
+def fleet_start():
+    """
+    按config.json中的FLEET配置启动发现响应服务
+    """
+    fleet_config = config.get('FLEET', {})
+    if fleet_config.get('enabled', True):
+        udp_serve(fleet_config.get('port', 37020), _fleet_handle)
+
+
+def fleet_collect(query: str = "status", timeout_ms: int = 0, targets=None) -> dict:
+    """
+    向所有目标发送一轮查询并收集回复
+    :param query: "hello" 或 "status"
+    :param timeout_ms: 等待回复时间，0表示使用配置值
+    :param targets: 目标地址列表，元素为"ip"或"ip:port"；None时使用FLEET.targets，未配置则广播
+    :return: 设备ID -> 回复内容
+    """
+    fleet_config = config.get('FLEET', {})
+    timeout_ms = timeout_ms or fleet_config.get('timeout_ms', 800)
+    port = fleet_config.get('port', 37020)
+    targets = targets or fleet_config.get('targets') or [fleet_config.get('broadcast', '255.255.255.255')]
+    sock = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+    peers = {}
+    try:
+        if hasattr(usocket, 'SO_BROADCAST'):
+            sock.setsockopt(usocket.SOL_SOCKET, usocket.SO_BROADCAST, 1)
+        payload = ujson.dumps({"q": query}).encode()
+        for target in targets:
+            host, _, target_port = target.partition(':')
+            sock.sendto(payload, (host, int(target_port) if target_port else port))
+        start = utime.ticks_ms()
+        while True:
+            remain = timeout_ms - utime.ticks_diff(utime.ticks_ms(), start)
+            if remain <= 0:
+                break
+            sock.settimeout(remain / 1000)
+            try:
+                data, addr = sock.recvfrom(512)
+            except OSError:
+                break  # 超时
+            try:
+                reply = ujson.loads(data)
+                peers[reply["id"]] = reply
+            except (ValueError, KeyError, TypeError):
+                continue
+    finally:
+        sock.close()
+    # 本机不一定能收到自己的广播
+    peers.setdefault(device_id(), fleet_digest() if query == "status" else _fleet_hello())
+    return peers
+
+
+def fleet_scan():
+    """
+    后台收集集群状态（结果由fleet_status显示）
+    """
+    if fleet_data["status"] == "collecting":
+        return "⚠️ 正在收集中，请稍后刷新"
+
+    def _collect_task():
+        fleet_data["status"] = "collecting"
+        try:
+            fleet_data.update(peers=fleet_collect("status"), status="ready", last_update=utime.time())
+        except Exception as e:
+            fleet_data.update(status="error", peers={"error": str(e)}, last_update=utime.time())
+
+    _thread.start_new_thread(_collect_task, ())
+    return "🔍 正在收集集群状态"
+
+
+def fleet_status() -> str:
+    """
+    集群状态表（显示最近一次收集结果）
+    """
+    if fleet_data["status"] == "idle":
+        return "🟢 就绪状态，运行fleet_scan收集"
+    if fleet_data["status"] == "collecting":
+        return "🟡 收集中..."
+    if fleet_data["status"] == "error":
+        return f"🔴 收集失败：{fleet_data['peers'].get('error')}"
+    rows = ["<table><tr><th>ID</th><th>IP</th><th>清单</th><th>STA</th><th>RSSI</th><th>运行(s)</th><th>内存</th></tr>"]
+    for peer_id in sorted(fleet_data["peers"]):
+        p = fleet_data["peers"][peer_id]
+        rows.append(f"<tr><td>{peer_id}</td><td>{p.get('ip')}</td><td>{p.get('mv')}</td><td>{p.get('sta')}</td>"
+                    f"<td>{p.get('rssi')}</td><td>{p.get('up')}</td><td>{p.get('mem')}</td></tr>")
+    rows.append("</table>")
+    return f"🟢 {len(fleet_data['peers'])}台设备" + "".join(rows)
+
+
+# -----------
+# 强制门户DNS
+# -----------
+_dns_config = config.get('DNS', {})
+dns_data = {
+    "ip": "",  # 缓存中应答使用的AP地址，地址变化时清空缓存
+    "cache": {},  # (小写域名, 查询类型) -> 去掉事务ID的应答报文
+    "queries": 0,
+    "hits": 0
+}
+# 各系统联网检测使用的路径，重定向到首页以弹出门户页面
+CAPTIVE_PATHS = ('/generate_204', '/gen_204', '/hotspot-detect.html', '/ncsi.txt', '/connecttest.txt',
+                 '/success.txt', '/canonical.html', '/redirect')
+
+
+def _dns_answer(qtype: int, qclass: int, ip: str) -> bytes:
+    """
+    构造回答段：A记录返回ip，其他类型返回空（NOERROR无记录）
+    """
+    if qtype == 1 and qclass == 1:
+        return b'\xc0\x0c' + ustruct.pack('>HHIH', 1, 1, _dns_config.get('ttl', 60), 4) + \
+               bytes(int(x) for x in ip.split('.'))
+    return b''
+
+
+def _dns_handle(data, addr):
+    """
+    响应DNS查询，所有域名都解析到AP地址
+    """
+    if len(data) < 17:
+        return None
+    flags, qdcount = ustruct.unpack('>HH', data[2:6])
+    if flags & 0xF800 or qdcount != 1:  # 只处理标准查询（QR=0，opcode=0）
+        return None
+    try:
+        end = 12
+        while data[end]:
+            end += data[end] + 1
+    except IndexError:
+        return None  # 报文被截断
+    qtype_class = data[end + 1:end + 5]
+    if len(qtype_class) < 4:
+        return None
+    ip = AP.ifconfig()[0]
+    cache = dns_data["cache"]
+    if ip != dns_data["ip"]:
+        cache.clear()
+        dns_data["ip"] = ip
+    dns_data["queries"] += 1
+    key = (data[12:end].lower(), qtype_class)
+    answer = cache.get(key)
+    if answer is None:
+        answer = _dns_answer(*ustruct.unpack('>HH', qtype_class), ip)
+        if len(cache) >= _dns_config.get('cache_size', 16):
+            cache.clear()
+        cache[key] = answer
+    else:
+        dns_data["hits"] += 1
+    # QR=1 AA=1，RD取自本次查询；问题段按原样回显（域名大小写可能与缓存的不同）
+    header = ustruct.pack('>HHHHH', 0x8400 | (flags & 0x0100), 1, 1 if answer else 0, 0, 0)
+    return data[:2] + header + data[12:end + 5] + answer
+
+
+def dns_start():
+    """
+    按config.json中的DNS配置启动强制门户DNS服务
+    """
+    if _dns_config.get('enabled', True):
+        udp_serve(_dns_config.get('port', 53), _dns_handle)
+
+
+def is_captive_probe(method: str, path: str) -> bool:
+    """
+    判断是否为系统联网检测请求
+    """
+    return method == 'GET' and path.split('?')[0] in CAPTIVE_PATHS
+
+
+# -----------
+# 流量录制
+# -----------
+# 录制文件格式：文件头CAPTURE_MAGIC，之后每个请求一条记录：
+# <IHH>(距上个请求的毫秒数, 请求行长度, body长度) + 请求行 + body
+CAPTURE_MAGIC = b'SWCAP1\n'
+# 含密码的参数：函数名 -> 参数序号；batch_config的参数是JSON，其中的password字段也要遮盖
+CAPTURE_SECRETS = {
+    "sta_start": (1,),
+    "update_ap_config": (2,),
+    "update_sta_config": (1,),
+    "auth_setup": (0,)
+}
+CAPTURE_JSON_SECRETS = ("batch_config",)
+_capture_config = config.get('CAPTURE', {})
+capture_data = {
+    "enabled": False,
+    "file": _capture_config.get('file', 'capture.bin'),
+    "max_bytes": _capture_config.get('max_bytes', 65536),  # 文件上限，达到后自动停止
+    "written": 0,
+    "last": 0,  # 上个请求的ticks_ms
+    "pending": [],  # 待写入flash的记录
+    "pending_bytes": 0
+}
+
+
+def _capture_flush():
+    if not capture_data["pending"]:
+        return
+    with open(capture_data["file"], 'ab') as f:
+        for record in capture_data["pending"]:
+            f.write(record)
+    capture_data["pending"] = []
+    capture_data["pending_bytes"] = 0
+
+
+def _redact_json(value: str) -> str:
+    """
+    遮盖URL编码的JSON中所有"password"字段的值，每个编码单元替换为等长的*，保持body长度不变
+    """
+    units = []  # (解码后的字符, 原编码文本)
+    i = 0
+    while i < len(value):
+        if value[i] == '%' and len(value) > i + 2:
+            try:
+                units.append((chr(int(value[i + 1:i + 3], 16)), value[i:i + 3]))
+                i += 3
+                continue
+            except ValueError:
+                pass
+        units.append((' ' if value[i] == '+' else value[i], value[i]))
+        i += 1
+    text = ''.join(u[0] for u in units)
+    start = 0
+    while True:
+        k = text.find('"password"', start)
+        if k < 0:
+            break
+        j = k + len('"password"')
+        while j < len(text) and text[j] in ' :':
+            j += 1
+        if j < len(text) and text[j] == '"':
+            end = j + 1
+            while end < len(text) and text[end] != '"':
+                end += 2 if text[end] == '\\' else 1
+            for m in range(j + 1, min(end, len(text))):
+                units[m] = ('*', '*' * len(units[m][1].encode()))
+        start = j
+    return ''.join(u[1] for u in units)
+
+
+def _capture_redact(path: str, body: str) -> str:
+    """
+    遮盖body中的密码（WiFi密码、登录密码等），长度不变以保持回放时序
+    """
+    path = path.split('?')[0]
+    if path == '/login':
+        fields, json_fields = ('password',), ()
+    else:
+        group = fun_config.get(path.split('/')[1] if '/' in path else '')
+        if group is None:
+            return body
+        fields = tuple(f'arg{i}' for i in CAPTURE_SECRETS.get(group['name'], ()))
+        json_fields = ('arg0',) if group['name'] in CAPTURE_JSON_SECRETS else ()
+    if not fields and not json_fields:
+        return body
+    pairs = body.split('&')
+    for i, pair in enumerate(pairs):
+        key, sep, value = pair.partition('=')
+        if key in fields:
+            pairs[i] = key + sep + '*' * len(value.encode())
+        elif key in json_fields:
+            pairs[i] = key + sep + _redact_json(value)
+    return '&'.join(pairs)
+
+
+def capture_record(request: str):
+    """
+    录制一个请求（积累约512字节后批量写入flash）
+    """
+    now = utime.ticks_ms()
+    delta = utime.ticks_diff(now, capture_data["last"]) if capture_data["written"] else 0
+    capture_data["last"] = now
+    head, _, body = request.partition('\r\n\r\n')
+    line = head.split('\r\n', 1)[0]
+    body = _capture_redact(request_line(request)[1], body)  # 不把密码写入flash
+    line = line.encode()
+    body = body.encode()
+    record = ustruct.pack('<IHH', delta, len(line), len(body)) + line + body
+    if capture_data["written"] + len(record) > capture_data["max_bytes"]:
+        capture_control("0")
+        return
+    capture_data["pending"].append(record)
+    capture_data["pending_bytes"] += len(record)
+    capture_data["written"] += len(record)
+    if capture_data["pending_bytes"] >= 512:
+        _capture_flush()
+
+
+def capture_control(enabled: str) -> str:
+    """
+    开始/停止流量录制（开始时覆盖原录制文件）
+    :param enabled: 1/0
+    :return: 当前状态
+    """
+    enabled = enabled.strip()
+    if enabled == "1":
+        with open(capture_data["file"], 'wb') as f:
+            f.write(CAPTURE_MAGIC)
+        capture_data.update(enabled=True, written=0, pending=[], pending_bytes=0)
+        log(LOG_INFO, "开始录制流量: %s", capture_data["file"])
+    elif enabled == "0":
+        if capture_data["enabled"]:
+            _capture_flush()
+            capture_data["enabled"] = False
+            log(LOG_INFO, "停止录制流量: %d字节", capture_data["written"])
+    else:
+        return "错误：enabled需为1或0"
+    return f"录制：{'进行中' if capture_data['enabled'] else '已停止'}，{capture_data['written']}字节"
+
+
 # -----------
 # 网络服务
 # -----------
+def read_request(conn, raw: bytes):
+    """
+    收全请求：首个数据包未收全body时按Content-Length继续读取，收全后再整体解码
+    :param conn: 客户端连接
+    :param raw: 首次recv得到的数据
+    :return: (请求字符串, None)，失败时为(None, 错误状态行)
+    """
+    head, _, body = raw.partition(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            try:
+                length = int(value)
+            except ValueError:
+                return None, '400 Bad Request'
+    if length > config.get('HTTP', {}).get('max_body', 4096):
+        return None, '413 Payload Too Large'
+    chunks = [body]
+    received = len(body)
+    while received < length:
+        chunk = conn.recv(min(1024, length - received))
+        if not chunk:
+            return None, '400 Bad Request'  # body不完整
+        chunks.append(chunk)
+        received += len(chunk)
+    try:
+        return (head + b'\r\n\r\n' + b''.join(chunks)).decode(), None
+    except UnicodeError:
+        return None, '400 Bad Request'
+
+
+def read_body(request: str) -> str:
+    """
+    获取POST body（请求已由read_request收全）
+    """
+    return request.partition('\r\n\r\n')[2]
+
+
 def start_webserver():
     s = usocket.socket()
-    s.bind(('0.0.0.0', 80))
+    s.bind(('0.0.0.0', config.get('HTTP', {}).get('port', 80)))
     s.listen(5)
+    # 服务已启动，确认OTA更新
+    ota_confirm()
 
     while True:
         conn, addr = s.accept()
-        request = conn.recv(1024).decode()
-
-        # 路由处理
-        if request.startswith('GET /'):
-            if request.startswith('GET /show/'):
-                group_id = request.split('/show/')[1].split()[0]
-                func = globals()[fun_config[group_id]['name']]
-                result = str(func())
-                conn.send('HTTP/1.1 200 OK\nContent-Type: text/plain; charset=utf-8\n\n' + result)
-            else:
-                conn.send('HTTP/1.1 200 OK\nContent-Type: text/html; charset=utf-8\n\n' + generate_html())
+        try:
+            power_touch(addr[0])
+            trace_request()
+            t_request = trace_begin()
+            t = trace_begin()
+            raw = conn.recv(1024)
+            trace_end("recv", t)
+            if raw.startswith(b'POST /upload/'):
+                # 上传的文件内容不整体读入内存，也不解码
+                # 可替换main.py即可执行任意代码：必须启用身份验证并持有有效会话
+                if not config.get('AUTH', {}).get('enabled'):
+                    _ota_reply(conn, '403 Forbidden', "错误：在线更新需先启用身份验证")
+                elif session_valid(_session_token(raw.partition(b'\r\n\r\n')[0].decode())):
+                    ota_upload(conn, raw)
+                else:
+                    conn.send('HTTP/1.1 401 Unauthorized\r\n\r\n')
+                conn.close()
+                trace_end("upload", t_request)
+                continue
+            # 先收全body，录制和各处理函数都使用完整请求
+            request, error = read_request(conn, raw)
+            if error:
+                conn.send(f'HTTP/1.1 {error}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n错误：请求无效或过大')
+                conn.close()
+                trace_end("request", t_request)
+                continue
+            method, path = request_line(request)
+            if not method:
+                conn.send('HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n错误：请求行无效')
+                conn.close()
+                trace_end("request", t_request)
+                continue
+            if capture_data["enabled"]:
+                capture_record(request)
+
+            # 路由处理
+            if is_captive_probe(method, path):
+                # 联网检测不需要登录，重定向到首页使系统弹出门户页面
+                conn.send(f'HTTP/1.1 302 Found\r\nLocation: http://{AP.ifconfig()[0]}/\r\nContent-Length: 0\r\n\r\n')
+            elif request.startswith('POST /login') or request.startswith('POST /logout'):
+                auth_handle(conn, request)
+            elif not auth_check(request):
+                if request.startswith('GET / '):
+                    send_response(conn, request, login_html, 'text/html; charset=utf-8', cache_key='login')
+                else:
+                    conn.send('HTTP/1.1 401 Unauthorized\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n'
+                              '错误：未登录或会话已过期')
+            elif request.startswith('GET /'):
+                if request.startswith('GET /trace'):
+                    trace_export(conn)
+                elif request.startswith('GET /logs'):
+                    q = parse_params(path.partition('?')[2])
+                    try:
+                        result = log_read(int(q.get('since', 0)), LOG_LEVELS.index(q.get('level', 'DEBUG').upper()))
+                        send_response(conn, request, ujson.dumps(result), 'application/json')
+                    except ValueError as e:
+                        conn.send(f'HTTP/1.1 400 Bad Request\n\n{str(e)}')
+                elif request.startswith('GET /sensor/'):
+                    name, _, query = path[len('/sensor/'):].partition('?')
+                    if name not in sensor_data:
+                        conn.send('HTTP/1.1 404 Not Found\nContent-Type: text/plain; charset=utf-8\n\n未知传感器')
+                    else:
+                        q = parse_params(query)
+                        try:
+                            result = sensor_query(name, int(q.get('window', 60)), int(q.get('points', 0)),
+                                                  q.get('mode', 'avg'))
+                            send_response(conn, request, ujson.dumps(result), 'application/json')
+                        except ValueError as e:
+                            conn.send(f'HTTP/1.1 400 Bad Request\n\n{str(e)}')
+                elif request.startswith('GET /show/'):
+                    group_id = path[len('/show/'):].split('?')[0]
+                    if group_id not in fun_config or fun_config[group_id]['type'] != 'show':
+                        # 只允许调用show类型的功能，其他类型需通过POST执行
+                        conn.send('HTTP/1.1 404 Not Found\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n未知显示组')
+                    else:
+                        func = globals()[fun_config[group_id]['name']]
+                        t = trace_begin()
+                        result = str(func())
+                        trace_end(fun_config[group_id]['name'], t)
+                        etag = make_etag(result)
+                        poll = f'X-Poll-Interval: {poll_interval(group_id, etag)}\r\n'
+                        if get_header(request, 'If-None-Match') == etag:
+                            # 结果未变化，返回空304
+                            conn.send(f'HTTP/1.1 304 Not Modified\r\nETag: {etag}\r\n{poll}\r\n')
+                        else:
+                            send_response(conn, request, result, etag=etag, headers=poll)
+                else:
+                    send_response(conn, request, generate_html, 'text/html; charset=utf-8', cache_key='/')
 
-        elif request.startswith('POST /'):
-            group_id = request.split()[1].split('/')[1]
-            group = fun_config[group_id]
+            elif request.startswith('POST /') and path.split('?')[0].split('/')[1] not in fun_config:
+                # 门户DNS把所有域名解析到本机，手机应用的后台请求也会到达这里
+                conn.send('HTTP/1.1 404 Not Found\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n未知功能')
 
-            # 分离headers和body
-            header_body = request.split('\r\n\r\n', 1)
-            body = header_body[1] if len(header_body) > 1 else ''
-
-            # 解析POST参数
-            params = {}
-            if body:
-                pairs = body.split('&')
-                for pair in pairs:
-                    if '=' in pair:
-                        key, value = pair.split('=', 1)
-                        # 解码处理
-                        decoded_value = unquote(value.replace('+', ' '))  # 同时处理空格编码
-                        params[key] = decoded_value
-
-            # 构建参数列表（带默认值）
-            expected_args = len(group['data'])
-            args = [params.get(f'arg{i}', '') for i in range(expected_args)]
-
-            # 执行对应函数
-            func = globals()[group['name']]
-
-            if group['type'] == 'rut':
-                try:
-                    result = func(*args)
-                    conn.send(f'HTTP/1.1 200 OK\nContent-Type: text/plain\n\n{result}')
-                except Exception as e:
-                    conn.send(f'HTTP/1.1 500 Error\n\n{str(e)}')
-            else:
-                # 特殊处理重启函数
-                if func == restart:
-                    conn.send('HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n')
-                    conn.close()
-                    utime.sleep_ms(300)
-                    machine.reset()
-                else:
+            elif request.startswith('POST /'):
+                group_id = path.split('?')[0].split('/')[1]
+                group = fun_config[group_id]
+
+                # 分离headers和body
+                t = trace_begin()
+                body = read_body(request)
+
+                # 解析POST参数
+                params = parse_params(body) if body else {}
+
+                # 构建参数列表（带默认值）
+                expected_args = len(group['data'])
+                args = [params.get(f'arg{i}', '') for i in range(expected_args)]
+                trace_end("parse", t)
+
+                # 执行对应函数
+                func = globals()[group['name']]
+
+                if group['type'] == 'rut':
                     try:
-                        func(*args)
-                        conn.send('HTTP/1.1 303 See Other\r\nLocation: /\r\n\r\n')
-                    except TypeError as e:
-                        print("参数错误:", e)
-        conn.close()
+                        t = trace_begin()
+                        result = func(*args)
+                        trace_end(group['name'], t)
+                        conn.send(f'HTTP/1.1 200 OK\nContent-Type: text/plain\n\n{result}')
+                    except Exception as e:
+                        log(LOG_ERROR, "%s执行异常: %s", group_id, e)
+                        conn.send(f'HTTP/1.1 500 Error\n\n{str(e)}')
+                else:
+                    # 特殊处理重启函数
+                    if func == restart:
+                        conn.send('HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n')
+                        conn.close()
+                        utime.sleep_ms(300)
+                        machine.reset()
+                    else:
+                        try:
+                            t = trace_begin()
+                            func(*args)
+                            trace_end(group['name'], t)
+                            conn.send('HTTP/1.1 303 See Other\r\nLocation: /\r\n\r\n')
+                        except TypeError as e:
+                            log(LOG_WARN, "%s参数错误: %s", group_id, e)
+            conn.close()
+            trace_end("request", t_request)
+        except Exception as e:
+            # 单个请求出错只断开该连接，不能让服务退出（main()会因此重启设备）
+            log(LOG_ERROR, "请求处理异常: %s", e)
+            conn.close()
 
 
-if __name__ == '__main__':
+def main():
     # 启动热点
     ap_start(**wifi_config["ap"])
-    print(AP.ifconfig())
+    log(LOG_INFO, "AP: %s", AP.ifconfig())
     # 启动wifi
     # 仅当有有效STA配置时尝试连接
     if wifi_config['sta'][0]['ssid']:
         sta_start(**wifi_config["sta"][0])
-        print(STA.ifconfig())
+        log(LOG_INFO, "STA: %s", STA.ifconfig())
+    # 启动后台传感器采样
+    sensor_start()
+    # 启动设备发现响应
+    fleet_start()
+    # 启动强制门户DNS
+    dns_start()
+    # 启动定时任务
+    sched_start()
+    # 启动空闲节能检测
+    power_start()
+    # 启动AP信道定期评估
+    channel_start()
+    # 按配置开始流量录制
+    if _capture_config.get('enabled', False):
+        capture_control("1")
     # 启动网络服务
     start_webserver()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        # 不停在REPL：重启后由boot.py计数，未确认的OTA更新会被回滚
+        print("启动失败:", e)
+        utime.sleep_ms(1000)
+        machine.reset()
@@ -0,0 +1,149 @@
+"""
+集群发现/状态汇总主机脚本（在PC上运行，协议与main.py的FLEET服务一致）
+
+用法：
+    python tools/fleet.py status                      # 广播收集所有设备状态
+    python tools/fleet.py hello --targets 192.168.4.1  # 只询问指定设备
+    python tools/fleet.py status --simulate 5          # 在本机回环上运行5个main.py实例，并用main.py的fleet_collect汇总
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def collect(targets, port, query="status", timeout=0.8):
+    """
+    发送一轮查询并收集回复
+    :param targets: 目标地址列表，元素为"ip"或"ip:port"
+    :param port: 默认端口
+    :param query: "hello" 或 "status"
+    :param timeout: 等待回复的秒数
+    :return: 设备ID -> 回复内容
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    payload = json.dumps({"q": query}).encode()
+    for target in targets:
+        host, _, p = target.partition(':')
+        sock.sendto(payload, (host, int(p or port)))
+
+    peers = {}
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                break
+            sock.settimeout(remain)
+            try:
+                data, addr = sock.recvfrom(512)
+            except socket.timeout:
+                break
+            try:
+                reply = json.loads(data)
+                peers[reply["id"]] = reply
+            except (ValueError, KeyError, TypeError):
+                continue
+    finally:
+        sock.close()
+    return peers
+
+
+def load_main(index, fleet):
+    """
+    在临时目录中以替身模块导入main.py（不启动网页服务）
+    :param index: 设备序号，用于生成不同的设备ID
+    :param fleet: 覆盖的FLEET配置
+    :return: main模块
+    """
+    sys.path.insert(0, HERE)
+    import mpstubs
+    mpstubs.install()
+    sys.modules['machine'].unique_id = lambda: b'\x24\x0a\xc4\x00' + index.to_bytes(2, 'big')
+
+    workdir = tempfile.mkdtemp(prefix='fleet-')
+    shutil.copy(os.path.join(ROOT, 'main.py'), workdir)
+    with open(os.path.join(ROOT, 'config.json')) as f:
+        config = json.load(f)
+    config['FLEET'].update(fleet)
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import main
+    return main
+
+
+def device(index, port):
+    """
+    运行一台模拟设备：main.py的发现响应服务监听127.0.0.1:port
+    """
+    main = load_main(index, {"enabled": True, "port": port})
+    main.fleet_start()
+    while True:
+        time.sleep(3600)
+
+
+def simulate(count, port):
+    """
+    启动count个main.py实例作为模拟设备（端口port+1起）
+    :return: (模拟设备地址列表, 子进程列表)
+    """
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'device', str(i + 1),
+                               '--port', str(port + 1 + i)])
+             for i in range(count)]
+    targets = ['127.0.0.1:%d' % (port + 1 + i) for i in range(count)]
+    deadline = time.monotonic() + 10
+    while len(collect(targets, port, "hello", 0.2)) < count:
+        if time.monotonic() > deadline:
+            for proc in procs:
+                proc.terminate()
+            raise RuntimeError("模拟设备未就绪")
+    return targets, procs
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'device':
+        parser = argparse.ArgumentParser(prog='fleet.py device')
+        parser.add_argument('index', type=int)
+        parser.add_argument('--port', type=int, required=True)
+        args = parser.parse_args(sys.argv[2:])
+        return device(args.index, args.port)
+
+    parser = argparse.ArgumentParser(description="收集设备集群状态")
+    parser.add_argument('query', choices=('hello', 'status'), nargs='?', default='status')
+    parser.add_argument('--port', type=int, default=37020)
+    parser.add_argument('--targets', default='255.255.255.255', help="逗号分隔的地址，默认广播")
+    parser.add_argument('--timeout', type=float, default=0.8, help="等待回复秒数")
+    parser.add_argument('--simulate', type=int, default=0,
+                        help="在回环上运行N个main.py实例，由另一个实例的fleet_collect收集（结果含发起收集的实例）")
+    args = parser.parse_args()
+
+    if args.simulate:
+        targets, procs = simulate(args.simulate, args.port)
+        try:
+            collector = load_main(0, {"enabled": False})
+            peers = collector.fleet_collect(args.query, int(args.timeout * 1000), targets)
+        finally:
+            for proc in procs:
+                proc.terminate()
+    else:
+        peers = collect(args.targets.split(','), args.port, args.query, args.timeout)
+    columns = ("id", "ip", "mv", "sta", "rssi", "up", "mem") if args.query == 'status' else ("id", "ip", "mv")
+    print("\t".join(columns))
+    for peer_id in sorted(peers):
+        print("\t".join(str(peers[peer_id].get(c, '')) for c in columns))
+    print(f"共{len(peers)}台设备")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+在CPython上运行main.py所需的MicroPython模块替身（network/machine/utime/usocket等）
+用法：先 import mpstubs; mpstubs.install()，再运行main.py
+"""
+import array
+import binascii
+import gc
+import hashlib
+import io
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+import types
+import zlib
+
+_TICKS_PERIOD = 1 << 30  # 与MicroPython一致，ticks在2^30处回绕
+_t0 = time.monotonic()
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# -----------
+# utime
+# -----------
+def ticks_ms():
+    return int((time.monotonic() - _t0) * 1000) % _TICKS_PERIOD
+
+
+def ticks_us():
+    return int((time.monotonic() - _t0) * 1000000) % _TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    if not -_TICKS_PERIOD // 2 <= delta < _TICKS_PERIOD // 2:
+        raise OverflowError("ticks interval overflow")  # 与MicroPython一致
+    return (ticks + delta) % _TICKS_PERIOD
+
+
+def ticks_diff(end, start):
+    diff = (end - start) % _TICKS_PERIOD
+    return diff - _TICKS_PERIOD if diff >= _TICKS_PERIOD // 2 else diff
+
+
+# -----------
+# network
+# -----------
+class WLAN:
+    """模拟的WLAN接口：AP可用，STA不会连上任何网络"""
+    PM_NONE = 0
+    PM_PERFORMANCE = 1
+    PM_POWERSAVE = 2
+    scan_result = [
+        (b'Neighbour-1', b'\x00\x11\x22\x33\x44\x55', 1, -48, 3, False),
+        (b'Neighbour-2', b'\x00\x11\x22\x33\x44\x56', 6, -71, 3, False),
+        (b'Neighbour-3', b'\x00\x11\x22\x33\x44\x57', 6, -80, 4, False),
+    ]
+
+    def __init__(self, interface):
+        self.interface = interface
+        self._active = False
+        self._config = {'essid': '', 'channel': 1, 'pm': self.PM_PERFORMANCE}
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0], 0)
+        self._config.update(kwargs)
+
+    def ifconfig(self):
+        if self.interface == 1:
+            return '192.168.4.1', '255.255.255.0', '192.168.4.1', '192.168.4.1'
+        return '0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0'
+
+    def isconnected(self):
+        return False
+
+    def connect(self, ssid, password):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def status(self, *args):
+        return 0
+
+    def scan(self):
+        time.sleep(0.05)
+        return list(self.scan_result)
+
+
+# -----------
+# machine
+# -----------
+class Pin:
+    OUT = 1
+    IN = 0
+
+    def __init__(self, pin, mode=-1):
+        self.pin = pin
+
+
+_freq = [240000000]
+
+
+def freq(value=None):
+    if value is None:
+        return _freq[0]
+    _freq[0] = value
+
+
+def reset():
+    print("machine.reset() 已忽略", file=sys.stderr)
+
+
+# -----------
+# usocket：send接受str，监听端口可复用
+# -----------
+class Socket(socket.socket):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.type == socket.SOCK_STREAM:
+            self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def send(self, data, *args):
+        return super().sendall(data.encode() if isinstance(data, str) else data)
+
+    def sendto(self, data, *args):
+        return super().sendto(data.encode() if isinstance(data, str) else data, *args)
+
+    def accept(self):
+        fd, addr = self._accept()
+        return Socket(self.family, self.type, self.proto, fileno=fd), addr
+
+
+# -----------
+# deflate（用zlib实现压缩）
+# -----------
+class DeflateIO:
+    RAW = 1
+    ZLIB = 2
+    GZIP = 3
+
+    def __init__(self, stream, fmt=0, wbits=0, close=False):
+        self.stream = stream
+        wbits = {self.RAW: -15, self.GZIP: 31}.get(fmt, 15)
+        self.compressor = zlib.compressobj(wbits=wbits)
+
+    def write(self, data):
+        self.stream.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        self.stream.write(self.compressor.flush())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def install():
+    """
+    注册替身模块到sys.modules
+    """
+    _module('utime', ticks_ms=ticks_ms, ticks_us=ticks_us, ticks_add=ticks_add, ticks_diff=ticks_diff,
+            sleep=time.sleep, sleep_ms=lambda ms: time.sleep(ms / 1000),
+            sleep_us=lambda us: time.sleep(us / 1000000),
+            time=lambda: int(time.time()), localtime=lambda t=None: time.localtime(t)[:8])
+    _module('network', WLAN=WLAN, STA_IF=0, AP_IF=1)
+    _module('machine', Pin=Pin, freq=freq, reset=reset, unique_id=lambda: b'\x24\x0a\xc4\x00\x00\x01')
+    usocket = _module('usocket')
+    usocket.__dict__.update((k, v) for k, v in socket.__dict__.items() if not k.startswith('__'))
+    usocket.socket = Socket
+    _module('deflate', DeflateIO=DeflateIO, RAW=DeflateIO.RAW, ZLIB=DeflateIO.ZLIB, GZIP=DeflateIO.GZIP)
+    for name, module in (('ujson', json), ('uarray', array), ('ubinascii', binascii), ('uhashlib', hashlib),
+                         ('uio', io), ('uos', os), ('ustruct', struct), ('uselect', select)):
+        sys.modules[name] = module
+    if not hasattr(gc, 'mem_free'):
+        gc.mem_free = lambda: 100000
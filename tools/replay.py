@@ -0,0 +1,206 @@
+"""
+流量回放：将设备录制的capture.bin按原始（或加速）节奏回放到在本机运行的main.py，
+统计各类请求的延迟分布，并对比两个版本
+
+用法：
+    python tools/replay.py capture.bin --build .                          # 回放到当前版本
+    python tools/replay.py capture.bin --build old/ --build . --speed 10  # 10倍速对比两个版本
+    python tools/replay.py serve . --port 8080                            # 仅在本机运行main.py
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+CAPTURE_MAGIC = b'SWCAP1\n'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_capture(path):
+    """
+    读取录制文件
+    :return: [(距上个请求的毫秒数, 请求行, body), ...]
+    """
+    records = []
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path}不是录制文件")
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                break
+            delta, line_len, body_len = struct.unpack('<IHH', head)
+            line = f.read(line_len).decode()
+            body = f.read(body_len)
+            records.append((delta, line, body))
+    return records
+
+
+def serve(build, port):
+    """
+    在临时目录中以替身模块运行build中的main.py（不会改动build中的文件）
+    """
+    sys.path.insert(0, HERE)
+    import mpstubs
+    mpstubs.install()
+
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    shutil.copy(os.path.join(build, 'main.py'), workdir)
+    with open(os.path.join(build, 'config.json')) as f:
+        config = json.load(f)
+    # 只保留HTTP服务，关闭会占用端口或写flash的附加功能
+    config.setdefault('HTTP', {})['port'] = port
+    for section in ('FLEET', 'CAPTURE', 'DNS'):
+        config.setdefault(section, {})['enabled'] = False
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    os.chdir(workdir)
+    sys.argv = ['main.py']
+    import runpy
+    runpy.run_path('main.py', run_name='__main__')
+
+
+def _wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口{port}未就绪")
+
+
+def route_key(line):
+    """请求分类：方法 + 路径（去掉查询参数）"""
+    method, path = (line.split() + ['', ''])[:2]
+    return f"{method} {path.split('?')[0]}"
+
+
+def send_request(port, line, body, timeout):
+    """
+    发送一个请求并读到服务端关闭连接
+    :return: 延迟（毫秒）
+    """
+    request = line.encode() + b'\r\nHost: device\r\n'
+    if body or line.startswith('POST'):
+        request += b'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n' % len(body)
+    request += b'\r\n' + body
+    start = time.perf_counter()
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall(request)
+        while sock.recv(4096):
+            pass
+    return (time.perf_counter() - start) * 1000
+
+
+def replay(records, build, port, speed, timeout):
+    """
+    回放到一个版本
+    :return: 分类 -> [延迟毫秒, ...]
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', build, '--port', str(port)],
+                            stdout=subprocess.DEVNULL)
+    try:
+        _wait_port(port)
+        latencies = {}
+        errors = 0
+        next_at = time.perf_counter()
+        for delta, line, body in records:
+            next_at += delta / 1000 / speed
+            wait = next_at - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                latency = send_request(port, line, body, timeout)
+            except OSError:
+                errors += 1
+                continue
+            latencies.setdefault(route_key(line), []).append(latency)
+        if errors:
+            print(f"{build}: {errors}个请求失败", file=sys.stderr)
+        return latencies
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(latencies):
+    """
+    :return: 分类 -> {"n", "p50", "p90", "p99", "max"}（含"ALL"总计）
+    """
+    result = {}
+    everything = []
+    for key, values in latencies.items():
+        everything += values
+        result[key] = values
+    result["ALL"] = everything
+    return {key: {"n": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+                  "p99": percentile(values, 99), "max": max(values)}
+            for key, values in result.items() if values}
+
+
+def report(builds, summaries):
+    keys = sorted(set().union(*summaries), key=lambda k: (k == "ALL", k))
+    for build, summary in zip(builds, summaries):
+        print(f"\n== {build}")
+        print(f"{'请求':<32}{'n':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+        for key in keys:
+            if key in summary:
+                s = summary[key]
+                print(f"{key:<32}{s['n']:>6}{s['p50']:>9.2f}{s['p90']:>9.2f}{s['p99']:>9.2f}{s['max']:>9.2f}")
+    if len(summaries) == 2:
+        base, new = summaries
+        print(f"\n== 差异 {builds[1]} 相对 {builds[0]}")
+        print(f"{'请求':<32}{'p50':>10}{'p90':>10}{'p99':>10}")
+        for key in keys:
+            if key in base and key in new:
+                cells = []
+                for p in ('p50', 'p90', 'p99'):
+                    change = (new[key][p] - base[key][p]) / base[key][p] * 100 if base[key][p] else 0
+                    cells.append(f"{change:>+9.1f}%")
+                print(f"{key:<32}" + "".join(cells))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        parser = argparse.ArgumentParser(prog='replay.py serve')
+        parser.add_argument('build')
+        parser.add_argument('--port', type=int, default=8080)
+        args = parser.parse_args(sys.argv[2:])
+        return serve(os.path.abspath(args.build), args.port)
+
+    parser = argparse.ArgumentParser(description="回放录制流量并统计延迟")
+    parser.add_argument('capture', help="设备上录制的capture.bin")
+    parser.add_argument('--build', action='append', required=True, help="包含main.py和config.json的目录，可指定两次进行对比")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速")
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--timeout', type=float, default=10.0, help="单个请求超时秒数")
+    args = parser.parse_args()
+    if len(args.build) > 2:
+        parser.error("最多对比两个版本")
+
+    records = read_capture(args.capture)
+    print(f"{len(records)}个请求，原始时长{sum(r[0] for r in records) / 1000:.1f}s，回放倍速{args.speed}")
+    summaries = [summarize(replay(records, os.path.abspath(build), args.port, args.speed, args.timeout))
+                 for build in args.build]
+    report(args.build, summaries)
+
+
+if __name__ == '__main__':
+    main()